@@ -0,0 +1,187 @@
+"""
+subgen 各阶段的基准测试
+
+使用合成的订阅和规则集, 通过本地 HTTP 服务提供, 分阶段统计耗时、吞吐量和峰值内存
+    python benchmark/bench.py --nodes 20000 --rules 100000 --save-baseline baseline.json
+    python benchmark/bench.py --nodes 20000 --rules 100000 --baseline baseline.json
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'subgen'))
+
+import ruleset_parser  # noqa: E402
+import synthetic  # noqa: E402
+import utils  # noqa: E402
+from config import FilterIndex, Proxy, ProxyGroup, Ruleset, Subscription  # noqa: E402
+from output import write_config  # noqa: E402
+from sub_parser import parse  # noqa: E402
+from utils import load_resources  # noqa: E402
+
+STAGES = ['load', 'parse', 'ruleset_parse', 'proxy_groups', 'rules', 'dump']
+
+
+def build_files(args):
+    files = {}
+    for index in range(args.subscriptions):
+        files[f'/sub/{index}.txt'] = synthetic.subscription(args.nodes, seed=index)
+    for rules_type in ('classic', 'domain', 'ipcidr'):
+        for index in range(args.rulesets):
+            files[f'/ruleset/{rules_type}-{index}.yaml'] = synthetic.ruleset(rules_type, args.rules, seed=index)
+    return files
+
+
+def build_proxy_groups(count):
+    proxy_groups = [ProxyGroup('select', 'PROXY', None, None, None, [], ['AUTO', 'DIRECT'])]
+    for index in range(count):
+        region = synthetic.REGIONS[index % len(synthetic.REGIONS)]
+        proxy_groups.append(ProxyGroup(
+            'url-test', f'{region} {index}', 'http://www.gstatic.com/generate_204', 300, 50,
+            [{'type': 'name', 'regex': f'^{region}', 'negative_regex': f'{index % 10}$'}], []
+        ))
+    return proxy_groups
+
+
+class StageRecorder:
+    def __init__(self, trace_memory):
+        self.trace_memory = trace_memory
+        self.results = {}
+
+    def run(self, stage, func):
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        items = func()
+        seconds = time.perf_counter() - start
+        result = {'seconds': seconds, 'items': items, 'throughput': items / seconds if seconds > 0 else 0}
+        if self.trace_memory:
+            result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self.results[stage] = result
+
+
+def run_pipeline(server, files, args, trace_memory):
+    recorder = StageRecorder(trace_memory)
+    subscriptions = [Subscription(f'sub{index}', server.url(path), 0, 'http', None)
+                     for index, path in enumerate(p for p in files if p.startswith('/sub/'))]
+    rulesets = [Ruleset(path.split('/')[-1].split('-')[0], server.url(path), None, 'PROXY', 0, 'http', None)
+                for path in files if path.startswith('/ruleset/')]
+    proxy_groups = build_proxy_groups(args.groups)
+    state = {}
+
+    def load():
+        state['contents'] = load_resources(subscriptions + rulesets, args.workers, args.per_host)
+        return sum(len(content) for content in state['contents'])
+
+    def parse_subscriptions():
+        for subscription, content in zip(subscriptions, state['contents']):
+            subscription.data = parse(content, subscription.url)
+        return sum(len(subscription.data) for subscription in subscriptions)
+
+    def parse_rulesets():
+        for ruleset, content in zip(rulesets, state['contents'][len(subscriptions):]):
+            ruleset.data = ruleset_parser.parse(content, ruleset.url)
+        return sum(len(ruleset.data) for ruleset in rulesets)
+
+    def generate_proxy_groups():
+        proxies = [Proxy(subscription.tag, proxy['name'], proxy)
+                   for subscription in subscriptions for proxy in subscription.data]
+        filter_index = FilterIndex(proxy_groups, proxies)
+        state['proxies'] = proxies
+        state['proxy_groups'] = [proxy_group.generate(proxies, filter_index) for proxy_group in proxy_groups]
+        return len(proxies) * len(proxy_groups)
+
+    def generate_rules():
+        state['rules'] = [rule.to_string() for ruleset in rulesets for rule in ruleset.generate()]
+        return len(state['rules'])
+
+    def dump():
+        config = {
+            'proxies': [proxy.data for proxy in state['proxies']],
+            'proxy-groups': state['proxy_groups']
+        }
+        with open(os.devnull, 'w', encoding='utf-8') as file:
+            write_config(file, config, state['rules'])
+        return len(state['rules']) + len(state['proxies'])
+
+    for stage, func in zip(STAGES, [load, parse_subscriptions, parse_rulesets,
+                                    generate_proxy_groups, generate_rules, dump]):
+        recorder.run(stage, func)
+    return recorder.results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for stage in STAGES:
+        if stage not in baseline:
+            continue
+        for metric in ('seconds', 'peak_bytes'):
+            current = results[stage].get(metric)
+            previous = baseline[stage].get(metric)
+            if current is None or not previous:
+                continue
+            if current > previous * (1 + tolerance):
+                regressions.append(f'{stage} {metric}: {previous:.4g} -> {current:.4g} '
+                                   f'(+{(current / previous - 1) * 100:.1f}%)')
+    return regressions
+
+
+def print_results(results):
+    print(f'{"stage":<16}{"seconds":>10}{"items":>12}{"items/s":>14}{"peak MiB":>12}')
+    for stage in STAGES:
+        result = results[stage]
+        print(f'{stage:<16}{result["seconds"]:>10.3f}{result["items"]:>12}{result["throughput"]:>14.0f}'
+              f'{result.get("peak_bytes", 0) / 1048576:>12.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='subgen pipeline benchmark')
+    parser.add_argument('--subscriptions', type=int, default=4, help='Number of subscriptions')
+    parser.add_argument('--nodes', type=int, default=2000, help='Nodes per subscription')
+    parser.add_argument('--rulesets', type=int, default=2, help='Rulesets per type (classic/domain/ipcidr)')
+    parser.add_argument('--rules', type=int, default=10000, help='Rules per ruleset')
+    parser.add_argument('--groups', type=int, default=40, help='Number of url-test proxy groups')
+    parser.add_argument('--latency', type=float, default=0.05, help='HTTP latency per request in seconds')
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent downloads')
+    parser.add_argument('--per-host', type=int, default=4, help='Concurrent downloads per host')
+    parser.add_argument('--baseline', help='Compare against this baseline file')
+    parser.add_argument('--save-baseline', help='Save results as a baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown before reporting')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    files = build_files(args)
+    server = synthetic.ResourceServer(files, args.latency).start()
+    utils.cache_store.directory = tempfile.mkdtemp(prefix='subgen-bench-')
+    try:
+        # 第一遍只计时, 第二遍用 tracemalloc 统计每个阶段的峰值内存
+        results = run_pipeline(server, files, args, trace_memory=False)
+        memory_results = run_pipeline(server, files, args, trace_memory=True)
+    finally:
+        server.stop()
+    for stage in STAGES:
+        results[stage]['peak_bytes'] = memory_results[stage]['peak_bytes']
+
+    print_results(results)
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import base64
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REGIONS = ['HK', 'JP', 'SG', 'US', 'TW', 'KR', 'DE', 'GB']
+SS_CIPHERS = ['aes-128-gcm', 'aes-256-gcm', 'chacha20-ietf-poly1305']
+SSR_CIPHERS = ['aes-128-cfb', 'aes-256-cfb', 'chacha20-ietf']
+SSR_PROTOCOLS = ['origin', 'auth_aes128_md5', 'auth_chain_a']
+SSR_OBFS = ['plain', 'http_simple', 'tls1.2_ticket_auth']
+
+
+def url_base64(text):
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip('=')
+
+
+def node_url(rng, index):
+    region = rng.choice(REGIONS)
+    name = f'{region} {index:05d}'
+    server = f'{region.lower()}{index}.node.example.com'
+    port = rng.randint(1000, 65000)
+    kind = rng.random()
+    if kind < 0.4:
+        return f'trojan://pw{index}@{server}:{port}?sni={server}&allowInsecure=1#{name.replace(" ", "%20")}'
+    if kind < 0.8:
+        user_info = base64.b64encode(f'{rng.choice(SS_CIPHERS)}:pw{index}'.encode()).decode().rstrip('=')
+        return f'ss://{user_info}@{server}:{port}#{name.replace(" ", "%20")}'
+    content = (f'{server}:{port}:{rng.choice(SSR_PROTOCOLS)}:{rng.choice(SSR_CIPHERS)}:{rng.choice(SSR_OBFS)}:'
+               f'{url_base64("pw" + str(index))}/?remarks={url_base64(name)}&obfsparam={url_base64(server)}')
+    return 'ssr://' + url_base64(content)
+
+
+def subscription(node_count, seed=0):
+    """trojan / ss / ssr 混合的 base64 订阅"""
+    rng = random.Random(seed)
+    lines = [node_url(rng, index) for index in range(node_count)]
+    return base64.b64encode('\n'.join(lines).encode())
+
+
+def random_domain(rng):
+    labels = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(3, 10)))
+              for _ in range(rng.randint(2, 3))]
+    return '.'.join(labels) + rng.choice(['.com', '.net', '.org', '.cn'])
+
+
+def random_ipv4_cidr(rng):
+    return f'{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.0/{rng.randint(16, 24)}'
+
+
+def random_cidr(rng):
+    if rng.random() < 0.9:
+        return random_ipv4_cidr(rng)
+    return f'2001:{rng.randint(0, 0xffff):x}:{rng.randint(0, 0xffff):x}::/{rng.randint(32, 48)}'
+
+
+def ruleset(rules_type, rule_count, seed=0):
+    """classic / domain / ipcidr 三种格式的规则集 YAML"""
+    rng = random.Random(seed)
+    lines = ['payload:']
+    for _ in range(rule_count):
+        if rules_type == 'domain':
+            entry = ('+.' if rng.random() < 0.5 else '') + random_domain(rng)
+        elif rules_type == 'ipcidr':
+            entry = random_cidr(rng)
+        else:
+            kind = rng.random()
+            if kind < 0.4:
+                entry = 'DOMAIN-SUFFIX,' + random_domain(rng)
+            elif kind < 0.6:
+                entry = 'DOMAIN,' + random_domain(rng)
+            elif kind < 0.7:
+                entry = 'DOMAIN-KEYWORD,' + random_domain(rng).split('.')[0]
+            else:
+                entry = 'IP-CIDR,' + random_ipv4_cidr(rng)
+        lines.append(f"  - '{entry}'")
+    return ('\n'.join(lines) + '\n').encode()
+
+
+class ResourceServer:
+    """本地 HTTP 服务, 按路径返回内存中的数据, 每个请求延迟 latency 秒"""
+
+    def __init__(self, files, latency=0.0, host='127.0.0.1', port=0):
+        self.files = files
+        self.latency = latency
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                time.sleep(server.latency)
+                body = server.files.get(self.path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, path):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}{path}'
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
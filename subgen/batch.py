@@ -0,0 +1,131 @@
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from config import PROCESS_SECTIONS, Config, Ruleset, configure_process, load_and_parse
+from generator import generate_file, read_base_config
+from graph import GenerationGraph, hash_inputs
+from utils import CACHE_DIR, calculate_url_hash
+
+
+class Profile:
+    def __init__(self, name, config, base_config, output, generate_options):
+        self.name = name
+        self.config = config
+        self.base_config = base_config
+        self.output = output
+        self.generate_options = generate_options
+
+
+def read_manifest(manifest_path):
+    """
+    读取批量生成清单, 清单中的相对路径相对于清单所在目录
+    {
+        "workers": 4,
+        "fetch": {...},
+        "cache": {...},
+        "parse": {...},
+        "profiles": [
+            {"name": "...", "config": "...", "base": "...", "output": "...",
+             "optimize_rules": false, "rule_provider_dir": "...", "rule_provider_url": "..."}
+        ]
+    }
+    fetch、cache、parse 作用于整个进程, 以清单中的设置为准, 配置文件中与清单不同的设置给出警告后被覆盖
+    """
+    with open(manifest_path, 'r', encoding='utf-8') as file:
+        manifest = json.load(file)
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+    def resolve(path):
+        return os.path.join(manifest_dir, path) if path is not None else None
+
+    profiles = []
+    base_configs = {}
+    for profile in manifest['profiles']:
+        base_path = resolve(profile['base'])
+        if base_path not in base_configs:
+            base_configs[base_path] = read_base_config(base_path)
+        profiles.append(Profile(
+            profile.get('name', profile['output']),
+            # 先只解析配置, 所有配置中的资源统一加载
+            Config(resolve(profile['config']), load=False, configure=False),
+            base_configs[base_path],
+            resolve(profile['output']),
+            {
+                'optimize_rules': profile.get('optimize_rules', False),
+                'rule_provider_dir': resolve(profile.get('rule_provider_dir')),
+                'rule_provider_url': profile.get('rule_provider_url')
+            }
+        ))
+
+    for profile in profiles:
+        check_process_settings(profile, manifest)
+    configure_process(manifest)
+
+    outputs = [profile.output for profile in profiles]
+    if len(set(outputs)) != len(outputs):
+        raise ValueError("Profiles must not share an output path")
+    return manifest, profiles
+
+
+def check_process_settings(profile, manifest):
+    for section in PROCESS_SECTIONS:
+        manifest_section = manifest.get(section, {})
+        for key, value in profile.config.process_settings[section].items():
+            if manifest_section.get(key) != value:
+                logging.warning(f"Profile [{profile.name}] sets {section}.{key} = {value!r}, "
+                                f"overridden by the manifest value {manifest_section.get(key)!r}; "
+                                f"{section} settings apply to the whole batch")
+
+
+def resource_key(resource):
+    # 下载内容和解析结果都相同的资源使用相同的键, 订阅的 tag 和规则集的 target 不影响解析结果
+    # 缓存时间不同的资源可能读到不同时间下载的内容, 不能共享
+    key = [type(resource).__name__, resource.resource_type, resource.url, resource.proxy, resource.mirrors,
+           resource.cache, resource.stale]
+    if isinstance(resource, Ruleset):
+        key.append(resource.rules_type)
+    return hash_inputs(key)
+
+
+def load_profiles(profiles, fetch):
+    """所有配置中相同的订阅和规则集只下载、解析一次, 其余实例共享解析结果"""
+    groups = {}
+    for profile in profiles:
+        for resource in profile.config.resources():
+            groups.setdefault(resource_key(resource), []).append(resource)
+
+    resources = [group[0] for group in groups.values()]
+    logging.info(f"Loading {len(resources)} distinct resources for {len(profiles)} profiles")
+    load_and_parse(resources, fetch)
+
+    for first, *others in groups.values():
+        for resource in others:
+            resource.content_hash = first.content_hash
+            resource.data = first.data
+
+
+def generate_profiles(profiles, workers=4, incremental=False):
+    """并行生成所有配置, 相同的规则集只生成一次规则, 返回实际写入了文件的配置名称"""
+    rule_cache = {}
+
+    def generate_profile(profile):
+        logging.info(f"Generating profile [{profile.name}]: {profile.output}")
+        os.makedirs(os.path.dirname(profile.output), exist_ok=True)
+        graph = None
+        if incremental:
+            graph = GenerationGraph(os.path.join(CACHE_DIR, 'graph'), calculate_url_hash(profile.output))
+        return generate_file(profile.config, profile.base_config, profile.output, graph,
+                             rule_cache=rule_cache, **profile.generate_options)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        written = list(executor.map(generate_profile, profiles))
+    return [profile.name for profile, changed in zip(profiles, written) if changed]
+
+
+def run_batch(manifest_path, incremental=False):
+    manifest, profiles = read_manifest(manifest_path)
+    load_profiles(profiles, manifest.get('fetch', {}))
+    written = generate_profiles(profiles, manifest.get('workers', 4), incremental)
+    logging.info(f"Batch generation complete, profiles: {len(profiles)}, written: {len(written)}")
@@ -0,0 +1,236 @@
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ENTRY_SUFFIX = '.entry'
+# 旧版本的缓存文件: <key>.cache 保存内容, <key>.meta 保存校验信息
+LEGACY_SUFFIX = '.cache'
+LEGACY_META_SUFFIX = '.meta'
+# 写入中断 (进程被杀死、请求被放弃) 时留下的临时文件, 超过该时间 (秒) 后删除
+TEMP_SUFFIX = '.tmp'
+STALE_TEMP_SECONDS = 3600
+
+
+def compress(data, compression):
+    if compression == 'gzip':
+        return gzip.compress(data, compresslevel=6)
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def decompress(data, compression):
+    if compression == 'gzip':
+        return gzip.decompress(data)
+    if compression == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def compression_setting(compression):
+    """配置中的压缩方式, 'none' 表示不压缩, 未安装 zstandard 时使用 gzip"""
+    if compression == 'zstd' and zstandard is None:
+        logging.warning("zstandard is not installed, falling back to gzip cache compression")
+        compression = 'gzip'
+    return compression if compression != 'none' else None
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def evict_directory(directory, max_size, suffix, keep_file=None):
+    """目录中以 suffix 结尾的文件总大小超过 max_size 时, 按 atime 从旧到新删除, keep_file 不会被删除"""
+    entries = []
+    total = 0
+    for entry in os.scandir(directory):
+        if not entry.name.endswith(suffix):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_atime, entry.path, stat.st_size))
+        total += stat.st_size
+
+    for _, path, size in sorted(entries):
+        if total <= max_size:
+            break
+        if path == keep_file:
+            continue
+        try:
+            os.remove(path)
+            total -= size
+            logging.info(f"Evicted cache entry: {path}")
+        except FileNotFoundError:
+            pass
+
+
+def remove_stale_temp_files(directory):
+    """删除目录中超过 STALE_TEMP_SECONDS 未修改的临时文件, 较新的文件可能仍在被其他进程写入"""
+    if not os.path.isdir(directory):
+        return
+    now = time.time()
+    for entry in os.scandir(directory):
+        if not entry.name.endswith(TEMP_SUFFIX):
+            continue
+        try:
+            if now - entry.stat().st_mtime > STALE_TEMP_SECONDS:
+                os.remove(entry.path)
+                logging.info(f"Removed stale temporary file: {entry.path}")
+        except FileNotFoundError:
+            pass
+
+
+class CacheStore:
+    """
+    下载内容的缓存目录, 每个条目是一个文件: 第一行为 JSON 头 (校验信息、压缩方式), 之后为内容
+    - 先写临时文件再 rename, 读取时不会看到写了一半的文件
+    - 同一个 key 的下载通过文件锁在多个进程间互斥
+    - 文件的 mtime 表示下载时间, atime 表示最近一次读取时间, 超出 max_size 时按 atime 淘汰
+    """
+
+    def __init__(self, directory, max_size=None, compression=None):
+        self.directory = directory
+        self.max_size = max_size
+        self.compression = compression
+        self.thread_locks = {}
+        self.thread_locks_lock = threading.Lock()
+        self.swept = False
+
+    def configure(self, max_size=None, compression=None):
+        if max_size is not None:
+            self.max_size = max_size
+        if compression is not None:
+            self.compression = compression_setting(compression)
+
+    def sweep(self):
+        """第一次使用缓存目录时执行一次: 将旧版本的 .cache/.meta 文件转换为条目, 删除残留的临时文件, 之后按大小淘汰"""
+        if self.swept:
+            return
+        self.swept = True
+        if not os.path.isdir(self.directory):
+            return
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(LEGACY_SUFFIX):
+                self.migrate(entry.name[:-len(LEGACY_SUFFIX)])
+            elif entry.name.endswith(LEGACY_META_SUFFIX) and \
+                    not os.path.exists(entry.path[:-len(LEGACY_META_SUFFIX)] + LEGACY_SUFFIX):
+                remove_file(entry.path)
+        remove_stale_temp_files(self.directory)
+        self.evict()
+
+    def migrate(self, key):
+        legacy_file = os.path.join(self.directory, key + LEGACY_SUFFIX)
+        meta_file = os.path.join(self.directory, key + LEGACY_META_SUFFIX)
+        with self.lock(key):
+            try:
+                if not os.path.exists(self.entry_file(key)):
+                    meta = {}
+                    if os.path.exists(meta_file):
+                        with open(meta_file, 'r', encoding='utf-8') as file:
+                            meta = json.load(file)
+                    with open(legacy_file, 'rb') as file:
+                        data = file.read()
+                    fetched_time = os.path.getmtime(legacy_file)
+                    self.write(key, data, meta, evict=False)
+                    # 保留原来的下载时间
+                    os.utime(self.entry_file(key), (time.time(), fetched_time))
+                    logging.info(f"Migrated legacy cache file: {legacy_file}")
+            except (OSError, ValueError) as e:
+                logging.warning(f"Unable to migrate legacy cache file {legacy_file}: {e}")
+            remove_file(legacy_file)
+            remove_file(meta_file)
+
+    def entry_file(self, key):
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    @contextmanager
+    def lock(self, key):
+        """同一个 key 的写操作互斥: 进程内使用线程锁, 进程间使用 flock, 一直等待到获取锁, 总是返回 True"""
+        with self.thread_locks_lock:
+            thread_lock = self.thread_locks.setdefault(key, threading.Lock())
+        with thread_lock:
+            if fcntl is None:
+                yield True
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, key + '.lock'), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield True
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def age(self, key):
+        """条目距离上次下载或验证的秒数, 条目不存在时返回 None"""
+        try:
+            return time.time() - os.path.getmtime(self.entry_file(key))
+        except FileNotFoundError:
+            return None
+
+    def read_entry(self, key):
+        try:
+            file = open(self.entry_file(key), 'rb')
+        except FileNotFoundError:
+            return None, None
+        with file:
+            header = json.loads(file.readline())
+            text = decompress(file.read(), header.get('compression')).decode('utf-8')
+
+        # 记录读取时间, 用于 LRU 淘汰, 保持 mtime (下载时间) 不变
+        entry_file = self.entry_file(key)
+        try:
+            os.utime(entry_file, (time.time(), os.path.getmtime(entry_file)))
+        except FileNotFoundError:
+            pass
+        return text, header
+
+    def read(self, key):
+        return self.read_entry(key)[0]
+
+    def read_meta(self, key):
+        try:
+            with open(self.entry_file(key), 'rb') as file:
+                return json.loads(file.readline())
+        except FileNotFoundError:
+            return {}
+
+    def write(self, key, data, meta, evict=True):
+        header = {**meta, 'compression': self.compression}
+        os.makedirs(self.directory, exist_ok=True)
+        entry_file = self.entry_file(key)
+        temp_file = f'{entry_file}.{os.getpid()}.{threading.get_ident()}{TEMP_SUFFIX}'
+        with open(temp_file, 'wb') as file:
+            file.write(json.dumps(header).encode() + b'\n')
+            file.write(compress(data, self.compression))
+        os.replace(temp_file, entry_file)
+        if evict:
+            self.evict(key)
+
+    def touch(self, key):
+        # 内容未变化 (304), 只更新下载时间
+        os.utime(self.entry_file(key))
+
+    def evict(self, keep_key=None):
+        if self.max_size is None:
+            return
+        keep_file = self.entry_file(keep_key) if keep_key is not None else None
+        evict_directory(self.directory, self.max_size, ENTRY_SUFFIX, keep_file)
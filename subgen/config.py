@@ -2,34 +2,63 @@ import json
 import logging
 import re
 
-from sub_parser import parse
-from utils import read_yaml_string, is_valid_ipv4, is_valid_ipv6, ExternalResource
+import http_session
+import ruleset_parser
+import sub_parser
+from metrics import metrics
+from sub_parser import parse_with_stats, record_stats
+from utils import is_valid_ipv4, is_valid_ipv6, ExternalResource, load_resources, \
+    calculate_content_hash, read_parsed_cache, write_parsed_cache, configure_cache
+
+# 这些部分的设置作用于整个进程, 批量生成时由清单统一设置
+PROCESS_SECTIONS = ('fetch', 'cache', 'parse')
+
+
+def configure_process(config_dict):
+    """按 fetch、cache、parse 部分设置连接池、超时、缓存后端和解析进程数"""
+    fetch = config_dict.get('fetch', {})
+    http_session.configure(
+        fetch.get('pool_size'),
+        fetch.get('connect_timeout'),
+        fetch.get('read_timeout'),
+        fetch.get('hedge_delay')
+    )
+    configure_cache(config_dict.get('cache', {}))
+    parse_config = config_dict.get('parse', {})
+    sub_parser.configure(parse_config.get('workers'), parse_config.get('batch_size'))
 
 
 class Config:
-    def __init__(self, config_file_path):
+    def __init__(self, config_file_path, load=True, configure=True):
         self.rulesets = None
         self.proxy_groups = None
         self.subscriptions = None
         self.base = None
+        self.fetch = None
+        self.dedup = None
+        self.health_check = None
+        self.group_templates = None
+        self.process_settings = None
 
         try:
             logging.info("Loading config file: " + config_file_path)
             with open(config_file_path, 'r', encoding='utf-8') as config_file:
                 config_dict = json.load(config_file)
-                self.parse_config(config_dict)
+                self.parse_config(config_dict, load, configure)
 
         except Exception as e:
             logging.info("Loading config file failed: " + config_file_path, e)
             raise e
 
-    def parse_config(self, config_dict):
+    def parse_config(self, config_dict, load=True, configure=True):
         self.subscriptions = [Subscription(
             subscription.get('tag'),
             subscription.get('url'),
             subscription.get('cache'),
             subscription.get('type'),
-            subscription.get('proxy')
+            subscription.get('proxy'),
+            subscription.get('stale'),
+            subscription.get('mirrors')
         ) for subscription in config_dict['subscriptions']]
         self.proxy_groups = [ProxyGroup(
             proxy_group.get('type'),
@@ -40,6 +69,19 @@ class Config:
             proxy_group.get('filters'),
             proxy_group.get('includes')
         ) for proxy_group in config_dict['proxy_groups']]
+        self.group_templates = [GroupTemplate(
+            template.get('name', '{key}'),
+            template.get('source', 'name'),
+            template.get('regex'),
+            template.get('type', 'url-test'),
+            template.get('test_url'),
+            template.get('interval'),
+            template.get('tolerance'),
+            template.get('max_nodes'),
+            template.get('parent'),
+            template.get('filters'),
+            template.get('includes')
+        ) for template in config_dict.get('group_templates', [])]
         self.rulesets = [Ruleset(
             ruleset.get('type'),
             ruleset.get('url'),
@@ -47,9 +89,49 @@ class Config:
             ruleset.get('target'),
             ruleset.get('cache'),
             ruleset.get('resource_type'),
-            ruleset.get('proxy')
+            ruleset.get('proxy'),
+            ruleset.get('stale'),
+            ruleset.get('mirrors')
         ) for ruleset in config_dict['rulesets']]
-        pass
+
+        self.dedup = config_dict.get('dedup', {})
+        self.health_check = config_dict.get('health_check', {})
+        self.fetch = config_dict.get('fetch', {})
+        self.process_settings = {section: config_dict.get(section, {}) for section in PROCESS_SECTIONS}
+        if configure:
+            configure_process(config_dict)
+        if load:
+            self.load(self.resources())
+
+    def resources(self):
+        return self.subscriptions + [ruleset for ruleset in self.rulesets if ruleset.url is not None]
+
+    def load(self, resources):
+        """并发下载所有订阅和规则集, 下载完成后按配置顺序解析, 返回内容发生变化的资源"""
+        return load_and_parse(resources, self.fetch)
+
+
+def load_and_parse(resources, fetch):
+    with metrics.stage('fetch'):
+        contents = load_resources(
+            resources,
+            fetch.get('workers', 8),
+            fetch.get('per_host', 4),
+            fetch.get('deadline')
+        )
+    changed = []
+    with metrics.stage('parse'):
+        for resource, content in zip(resources, contents):
+            content_hash = calculate_content_hash(content)
+            if content_hash != resource.content_hash:
+                resource.content_hash = content_hash
+                resource.parse_content(content)
+                changed.append(resource)
+    return changed
+
+
+# 基础配置中节点的 tag, 这些节点可能被分组的 includes 或规则按名称引用
+BASE_CONFIG_TAG = ""
 
 
 class Proxy:
@@ -70,25 +152,58 @@ class Filter:
             self.negative_regex = negative_regex
         else:
             self.negative_regex = r'^(?!.*\S).*$'
+        self.pattern = re.compile(self.regex)
+        self.negative_pattern = re.compile(self.negative_regex)
+
+    def key(self):
+        return self.type, self.regex, self.negative_regex
 
     def filter(self, proxies: list[Proxy]):
+        return [proxy for proxy in proxies if self.match(proxy)]
+
+    def match(self, proxy: Proxy):
         if self.type == 'tag':
-            return [proxy for proxy in proxies if self.check_regex_condition(proxy.tag)]
+            return self.check_regex_condition(proxy.tag)
         elif self.type == 'name':
-            return [proxy for proxy in proxies if self.check_regex_condition(proxy.name)]
+            return self.check_regex_condition(proxy.name)
         else:
             raise ValueError("Unsupported filter type: " + self.type)
 
     def check_regex_condition(self, input_string):
-        # 检查是否存在满足正则表达式的子串
-        if re.search(self.regex, input_string):
-            # 检查是否存在满足负正则表达式的子串
-            if not re.search(self.negative_regex, input_string):
-                logging.debug(f'{input_string} satisfies regex: {self.regex} -regex:{self.negative_regex}')
-                return True
-
-        logging.debug(f'{input_string} not satisfy regex:{self.regex} -regex:{self.negative_regex}')
-        return False
+        # 存在满足正则表达式的子串, 且不存在满足负正则表达式的子串
+        return self.pattern.search(input_string) is not None and self.negative_pattern.search(input_string) is None
+
+
+class FilterIndex:
+    """所有分组的过滤器去重后只编译一次, 遍历一次节点列表, 用位掩码记录每个节点满足的过滤器"""
+
+    def __init__(self, proxy_groups: list, proxies: list[Proxy]):
+        self.proxies = proxies
+        self.filter_ids = {}
+        filters = []
+        for proxy_group in proxy_groups:
+            for filter_item in proxy_group.filters:
+                if filter_item.key() not in self.filter_ids:
+                    self.filter_ids[filter_item.key()] = len(filters)
+                    filters.append(filter_item)
+
+        self.proxy_masks = []
+        for proxy in proxies:
+            mask = 0
+            for index, filter_item in enumerate(filters):
+                if filter_item.match(proxy):
+                    mask |= 1 << index
+            self.proxy_masks.append(mask)
+        logging.info(f"Filter index built, filters: {len(filters)}, proxies: {len(proxies)}")
+
+    def members(self, filters: list[Filter]):
+        # 没有过滤器的分组不包含任何节点
+        if len(filters) == 0:
+            return []
+        mask = 0
+        for filter_item in filters:
+            mask |= 1 << self.filter_ids[filter_item.key()]
+        return [proxy for proxy, proxy_mask in zip(self.proxies, self.proxy_masks) if proxy_mask & mask == mask]
 
 
 class ProxyGroup:
@@ -112,18 +227,18 @@ class ProxyGroup:
             includes = []
         self.includes = includes
 
-    def generate(self, proxies: list[Proxy]):
+    def key(self):
+        return (self.type, self.name, self.test_url, self.interval, self.tolerance,
+                [filter_item.key() for filter_item in self.filters], self.includes)
+
+    def generate(self, proxies: list[Proxy], filter_index: FilterIndex = None):
         # 筛选代理列表
         logging.info(f"Generation proxy group [{self.name}], type: {self.type}")
-        proxy_list = []
-
-        if self.filters is None or len(self.filters) == 0:
-            proxy_list = []
-        else:
-            proxy_list = proxies.copy()
-            for filter_item in self.filters:
-                proxy_list = filter_item.filter(proxy_list)
+        if filter_index is None:
+            filter_index = FilterIndex([self], proxies)
+        return self.build(filter_index.members(self.filters))
 
+    def build(self, proxy_list: list[Proxy]):
         result = {}
         if self.type == 'url-test':
             result = {
@@ -147,6 +262,87 @@ class ProxyGroup:
         return result
 
 
+class GroupTemplate:
+    """
+    按正则从节点名称或 tag 中提取键, 每个键自动生成一个分组, 键为第一个捕获组, 没有捕获组时为整个匹配
+    节点数超过 max_nodes 时拆分为多个分组, 指定 parent 时再生成一个包含所有分组的 select 分组
+    """
+
+    def __init__(self, name: str, source: str, regex: str, type: str, test_url: str, interval: int,
+                 tolerance: int, max_nodes: int = None, parent: str = None, filters: list = None,
+                 includes: list = None):
+        self.name = name
+        self.source = source
+        self.regex = regex
+        self.pattern = re.compile(regex)
+        self.type = type
+        self.test_url = test_url
+        self.interval = interval
+        self.tolerance = tolerance
+        self.max_nodes = max_nodes
+        self.parent = parent
+
+        if filters is None:
+            filters = []
+        self.filters = [Filter(
+            filter_item.get('type'),
+            filter_item.get('regex'),
+            filter_item.get('negative_regex')
+        ) for filter_item in filters]
+
+        if includes is None:
+            includes = []
+        self.includes = includes
+
+    def key(self):
+        return (self.name, self.source, self.regex, self.type, self.test_url, self.interval, self.tolerance,
+                self.max_nodes, self.parent, [filter_item.key() for filter_item in self.filters], self.includes)
+
+    def shard_key(self, proxy: Proxy):
+        if self.source == 'tag':
+            match = self.pattern.search(proxy.tag)
+        elif self.source == 'name':
+            match = self.pattern.search(proxy.name)
+        else:
+            raise ValueError("Unsupported group template source: " + self.source)
+        if match is None:
+            return None
+        return match.group(1) if self.pattern.groups > 0 else match.group(0)
+
+    def generate(self, proxies: list[Proxy], filter_index: FilterIndex = None):
+        # 有过滤器时先筛选节点, 再按键分组, 分组顺序为键第一次出现的顺序
+        if len(self.filters) > 0:
+            if filter_index is None:
+                filter_index = FilterIndex([self], proxies)
+            proxies = filter_index.members(self.filters)
+        shards = {}
+        for proxy in proxies:
+            shard_key = self.shard_key(proxy)
+            if shard_key is not None:
+                shards.setdefault(shard_key, []).append(proxy)
+
+        groups = []
+        for shard_key, members in shards.items():
+            # 只替换 {key}, 名称中的其他花括号原样保留
+            name = self.name.replace('{key}', shard_key)
+            size = self.max_nodes if self.max_nodes else len(members)
+            chunks = [members[start:start + size] for start in range(0, len(members), size)]
+            for index, chunk in enumerate(chunks):
+                chunk_name = name if len(chunks) == 1 else f'{name} {index + 1}'
+                groups.append(ProxyGroup(self.type, chunk_name, self.test_url, self.interval, self.tolerance,
+                                         [], self.includes).build(chunk))
+
+        logging.info(f"Group template [{self.name}] expanded, keys: {len(shards)}, groups: {len(groups)}")
+        if self.parent is None:
+            return groups
+        parent = {
+            'name': self.parent,
+            'type': 'select',
+            'proxies': [group['name'] for group in groups]
+        }
+        return [parent] + groups
+
+
 class Rule:
     def __init__(self, rule_type: str, param: str, target: str):
         self.rule_type = rule_type
@@ -160,13 +356,27 @@ class Rule:
 
 
 class Ruleset(ExternalResource):
-    def __init__(self, rules_type: str, url: str, params: list, target: str, cache: int, resource_type: str, proxy: str):
+    def __init__(self, rules_type: str, url: str, params: list, target: str, cache: int, resource_type: str, proxy: str,
+                 stale: int = None, mirrors: list = None):
         self.rules_type = rules_type
         self.params = params
         self.target = target
-        super().__init__(resource_type, url, cache, proxy)
-        if url is not None:
-            self.data = read_yaml_string(self.load())['payload']
+        self.data = None
+        super().__init__(resource_type, url, cache, proxy, stale, mirrors)
+
+    def parse_content(self, content):
+        # 内容未变化时直接读取上次解析的结果
+        key = f'{self.content_hash or calculate_content_hash(content)}-{self.rules_type}'
+        data = read_parsed_cache(key)
+        if data is None:
+            data = ruleset_parser.parse(content, self.url)
+            write_parsed_cache(key, data)
+        else:
+            logging.info(f"Using parsed ruleset cache: {self.url}")
+        self.data = data
+
+    def key(self):
+        return self.rules_type, self.url, self.params, self.target, self.content_hash
 
     def generate(self):
         logging.info(f"Generate rules from {self.url} , TARGET: {self.target}")
@@ -185,47 +395,53 @@ class Ruleset(ExternalResource):
             raise ValueError()
 
     def generate_clash_classic(self):
-        rules = []
         for line in self.data:
             line_data = line.split(',')
-            rules.append(Rule(line_data[0], line_data[1], self.target))
-        return rules
+            yield Rule(line_data[0], line_data[1], self.target)
 
     def generate_clash_domain(self):
-        rules = []
         for line in self.data:
             if line.startswith('+.'):
-                rules.append(Rule('DOMAIN-SUFFIX', line[2:], self.target))
+                yield Rule('DOMAIN-SUFFIX', line[2:], self.target)
             else:
-                rules.append(Rule('DOMAIN', line, self.target))
-        return rules
+                yield Rule('DOMAIN', line, self.target)
 
     def generate_clash_ipcidr(self):
-        rules = []
         for line in self.data:
             if is_valid_ipv4(line):
-                rules.append(Rule('IP-CIDR', line, self.target))
+                yield Rule('IP-CIDR', line, self.target)
             elif is_valid_ipv6(line):
-                rules.append(Rule('IP-CIDR6', line, self.target))
+                yield Rule('IP-CIDR6', line, self.target)
             else:
                 raise ValueError(line + " is not valid ip address")
-        return rules
 
     def generate_clash(self):
-        rules = []
         if self.url is None:
             for param in self.params:
-                rules.append(Rule(self.rules_type, param, self.target))
+                yield Rule(self.rules_type, param, self.target)
         else:
             for line in self.data:
-                rules.append(Rule(self.rules_type, line, self.target))
-        return rules
+                yield Rule(self.rules_type, line, self.target)
 
 
 class Subscription(ExternalResource):
-    def __init__(self, tag: str, url: str, cache: int, resource_type: str, proxy: str):
+    def __init__(self, tag: str, url: str, cache: int, resource_type: str, proxy: str, stale: int = None,
+                 mirrors: list = None):
         self.tag = tag
         self.url = url
         self.cache = cache
-        super().__init__(resource_type, url, cache, proxy)
-        self.data = parse(self.load(), self.url)
+        self.data = None
+        super().__init__(resource_type, url, cache, proxy, stale, mirrors)
+
+    def parse_content(self, content):
+        # 订阅内容未变化时直接读取上次解析的节点
+        key = f'{self.content_hash or calculate_content_hash(content)}-subscription'
+        cached = read_parsed_cache(key)
+        if cached is None:
+            data, stats = parse_with_stats(content, self.url)
+            write_parsed_cache(key, {'nodes': data, 'stats': dict(stats)})
+        else:
+            logging.info(f"Using parsed subscription cache: {self.url}")
+            data = cached['nodes']
+            record_stats(cached['stats'])
+        self.data = data
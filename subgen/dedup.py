@@ -0,0 +1,64 @@
+import json
+import logging
+
+from config import Proxy, BASE_CONFIG_TAG
+
+
+def endpoint_identity(proxy: Proxy):
+    # 除名称以外的所有字段都相同时视为同一个节点
+    return json.dumps({key: value for key, value in proxy.data.items() if key != 'name'},
+                      sort_keys=True, ensure_ascii=False, default=str)
+
+
+def deduplicate_proxies(proxies: list[Proxy], prefer: list = None):
+    """
+    删除重复节点并处理重名节点
+    prefer 为 tag 列表, 重复节点中 tag 排在前面的保留, 未列出的 tag 排在最后, 其余按出现顺序
+    基础配置中的节点可能被按名称引用, 总是保留原名, 与其重复或重名的订阅节点被删除或改名
+    """
+    if prefer is None:
+        prefer = []
+    tag_rank = {tag: rank for rank, tag in enumerate(prefer)}
+
+    def rank(position):
+        return tag_rank.get(proxies[position].tag, len(prefer)), position
+
+    # 以节点的规范化内容建立哈希索引, 记录每个节点当前保留的位置
+    winners = {}
+    base_positions = []
+    for position, proxy in enumerate(proxies):
+        identity = endpoint_identity(proxy)
+        if proxy.tag == BASE_CONFIG_TAG:
+            base_positions.append(position)
+            winners[identity] = position
+        elif identity not in winners or (proxies[winners[identity]].tag != BASE_CONFIG_TAG
+                                         and rank(position) < rank(winners[identity])):
+            winners[identity] = position
+    kept = sorted(set(winners.values()) | set(base_positions))
+
+    # 重名节点按顺序编号, 第一个保留原名
+    result = []
+    used_names = set(proxies[position].name for position in kept)
+    seen_names = set(proxy.name for proxy in proxies if proxy.tag == BASE_CONFIG_TAG)
+    renamed = 0
+    for position in kept:
+        proxy = proxies[position]
+        if proxy.tag == BASE_CONFIG_TAG:
+            result.append(proxy)
+            continue
+        if proxy.name not in seen_names:
+            seen_names.add(proxy.name)
+            result.append(proxy)
+            continue
+
+        index = 2
+        while f'{proxy.name} {index}' in used_names:
+            index += 1
+        name = f'{proxy.name} {index}'
+        used_names.add(name)
+        seen_names.add(name)
+        result.append(Proxy(proxy.tag, name, {**proxy.data, 'name': name}))
+        renamed += 1
+
+    logging.info(f"Proxy deduplication complete, removed: {len(proxies) - len(kept)}, renamed: {renamed}")
+    return result
@@ -0,0 +1,223 @@
+import hashlib
+import logging
+import os
+import time
+
+import yaml
+
+from config import FilterIndex
+from config import Proxy, BASE_CONFIG_TAG
+from dedup import deduplicate_proxies
+from graph import hash_inputs
+from health_check import HealthChecker, apply_health_check
+from metrics import metrics
+from output import write_config
+from rule_optimizer import compact_rules
+from rule_provider import write_rule_providers, provider_rules
+
+
+def read_base_config(base_path):
+    with open(base_path, 'r') as file:
+        return yaml.safe_load(file)
+
+
+def collect_proxies(generation_config, base_config):
+    # 提取节点信息
+    all_proxies = [Proxy(subscription.tag, proxy['name'], proxy)
+                   for subscription in generation_config.subscriptions
+                   for proxy in subscription.data
+                   ]
+
+    # 节点添加基础配置节点
+    if 'proxies' in base_config:
+        all_proxies = [Proxy(BASE_CONFIG_TAG, proxy['name'], proxy) for proxy in base_config['proxies']] + all_proxies
+
+    # 删除重复节点, 处理重名节点
+    if generation_config.dedup.get('enabled', False):
+        all_proxies = deduplicate_proxies(all_proxies, generation_config.dedup.get('prefer'))
+
+    # 检查节点是否可达, 删除或降级不可达的节点
+    health_check = generation_config.health_check
+    if health_check.get('enabled', False):
+        with metrics.stage('health_check'):
+            checker = HealthChecker(
+                health_check.get('concurrency', 200),
+                health_check.get('timeout', 3),
+                health_check.get('ttl', 600)
+            )
+            reachable = checker.check(all_proxies)
+            all_proxies = apply_health_check(all_proxies, reachable, health_check.get('action', 'drop'))
+    return all_proxies
+
+
+def check_group_names(groups, all_proxies, template_start):
+    """
+    clash 中分组和节点共用一个命名空间, 名称重复时整个配置无法加载
+    涉及模板生成的分组 (template_start 之后) 时报错, 只涉及手写分组时与之前一样只给出警告
+    """
+    proxy_names = {proxy.name for proxy in all_proxies}
+    group_positions = {}
+    for position, group in enumerate(groups):
+        name = group['name']
+        if name in group_positions:
+            message = f"Duplicate proxy group name: {name}"
+            previous = group_positions[name]
+        elif name in proxy_names:
+            message = f"Proxy group name conflicts with a proxy: {name}"
+            previous = None
+        else:
+            group_positions[name] = position
+            continue
+        if position >= template_start or (previous is not None and previous >= template_start):
+            raise ValueError(message)
+        logging.warning(message)
+
+
+def generate_proxy_groups(proxy_groups, all_proxies, graph=None, group_templates=None):
+    """生成配置中的分组, 之后是模板展开的分组"""
+    if group_templates is None:
+        group_templates = []
+    if graph is None:
+        filter_index = FilterIndex(proxy_groups + group_templates, all_proxies)
+        result = [proxy_group.generate(all_proxies, filter_index) for proxy_group in proxy_groups]
+        for template in group_templates:
+            result.extend(template.generate(all_proxies, filter_index))
+        check_group_names(result, all_proxies, len(proxy_groups))
+        return result
+
+    # 分组结果只依赖分组定义和节点的 tag/name, 两者都未变化时复用上次的结果
+    proxies_key = hash_inputs([(proxy.tag, proxy.name) for proxy in all_proxies])
+    filter_index = None
+
+    def get_filter_index():
+        nonlocal filter_index
+        if filter_index is None:
+            filter_index = FilterIndex(proxy_groups + group_templates, all_proxies)
+        return filter_index
+
+    result = []
+    for position, proxy_group in enumerate(proxy_groups):
+        key = hash_inputs(proxy_group.key(), proxies_key)
+        result.append(graph.node(f'proxy-group-{position}', key,
+                                 lambda: proxy_group.generate(all_proxies, get_filter_index())))
+    for position, template in enumerate(group_templates):
+        key = hash_inputs(template.key(), proxies_key)
+        result.extend(graph.node(f'group-template-{position}', key,
+                                 lambda: template.generate(all_proxies, get_filter_index())))
+    check_group_names(result, all_proxies, len(proxy_groups))
+    return result
+
+
+def rules_key(generation_config, optimize_rules, rule_provider_dir, rule_provider_url, output_dir):
+    # 规则集的 key 包含原始内容的哈希, 不需要展开规则
+    return hash_inputs([ruleset.key() for ruleset in generation_config.rulesets],
+                       optimize_rules, rule_provider_dir, rule_provider_url, output_dir)
+
+
+def ruleset_rules(rulesets, rule_cache=None):
+    """rule_cache 不为空时, 相同的规则集只生成一次规则, 在多个配置之间共享"""
+    for ruleset in rulesets:
+        if rule_cache is None:
+            yield from ruleset.generate()
+            continue
+        key = hash_inputs(ruleset.key())
+        rules = rule_cache.get(key)
+        if rules is None:
+            rules = rule_cache.setdefault(key, list(ruleset.generate()))
+        yield from rules
+
+
+def rule_strings(rules, optimize_rules=False):
+    # 删除不会被匹配的规则, 合并网段
+    # 后面的规则可能被任意前面的规则遮蔽, 优化时需要完整的规则列表, 不再逐条流式生成
+    if optimize_rules:
+        rules, _ = compact_rules(rules)
+    return (rule.to_string() for rule in rules)
+
+
+def generate(generation_config, base_config, file, output_dir,
+             optimize_rules=False, rule_provider_dir=None, rule_provider_url=None, graph=None, rule_cache=None):
+    """根据已加载的配置生成 clash 配置并写入 file, base_config 不会被修改"""
+    base_config = dict(base_config)
+    all_proxies = collect_proxies(generation_config, base_config)
+
+    # 写入 proxies
+    base_config['proxies'] = [proxy.data for proxy in all_proxies]
+
+    # 生成 proxy groups
+    with metrics.stage('filter'):
+        base_config['proxy-groups'] = generate_proxy_groups(generation_config.proxy_groups, all_proxies, graph,
+                                                            generation_config.group_templates)
+
+    # 生成 rules, 写入文件时逐条生成
+    with metrics.stage('rules'):
+        if rule_provider_dir is not None:
+            # 规则集写入单独的 provider 文件, 主配置只引用 RULE-SET
+            providers, provider_names = write_rule_providers(
+                generation_config.rulesets,
+                rule_provider_dir,
+                output_dir,
+                rule_provider_url
+            )
+            base_config['rule-providers'] = {**base_config.get('rule-providers', {}), **providers}
+            rules = rule_strings(provider_rules(generation_config.rulesets, provider_names), optimize_rules)
+        else:
+            # 规则不保存在依赖图中, 规则集内容的哈希已经包含在输出节点的输入中
+            rules = rule_strings(ruleset_rules(generation_config.rulesets, rule_cache), optimize_rules)
+
+    # 规则在写入时才逐条生成, 序列化耗时需要扣除其中生成规则的时间
+    start = time.perf_counter()
+    rules_seconds = metrics.stage_seconds('rules')
+    write_config(file, base_config, metrics.timed(rules, 'rules'))
+    rules_seconds = metrics.stage_seconds('rules') - rules_seconds
+    metrics.add('stage_seconds_total', time.perf_counter() - start - rules_seconds, stage='serialization')
+    logging.info(f"Generation complete, proxies: {len(all_proxies)}, "
+                 f"proxy groups: {len(base_config['proxy-groups'])}")
+
+
+def file_hash(path):
+    hash_object = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            hash_object.update(chunk)
+    return hash_object.hexdigest()
+
+
+def generate_file(generation_config, base_config, output_path, graph=None, rule_cache=None, **generate_options):
+    """生成配置文件, 输出内容与现有文件完全相同时不重写文件"""
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    output_node = f'output-{hashlib.md5(os.path.abspath(output_path).encode()).hexdigest()}'
+    output_key = None
+
+    # 健康检查的结果随时间变化, 启用时不能只根据输入判断是否跳过
+    if graph is not None and not generation_config.health_check.get('enabled', False):
+        # 所有输入都未变化, 且输出文件未被修改时直接跳过
+        output_key = hash_inputs(
+            base_config,
+            [(subscription.tag, subscription.content_hash) for subscription in generation_config.subscriptions],
+            [proxy_group.key() for proxy_group in generation_config.proxy_groups],
+            [template.key() for template in generation_config.group_templates],
+            generation_config.dedup,
+            rules_key(generation_config, output_dir=output_dir, **generate_options)
+        )
+        found, output_hash = graph.get(output_node, output_key)
+        if found and os.path.exists(output_path) and file_hash(output_path) == output_hash:
+            logging.info(f"Inputs unchanged, skip generating {output_path}")
+            return False
+
+    temp_file = f'{output_path}.{os.getpid()}.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as file:
+        generate(generation_config, base_config, file, output_dir, graph=graph, rule_cache=rule_cache,
+                 **generate_options)
+
+    output_hash = file_hash(temp_file)
+    if output_key is not None:
+        graph.put(output_node, output_key, output_hash)
+
+    if os.path.exists(output_path) and file_hash(output_path) == output_hash:
+        os.remove(temp_file)
+        logging.info(f"Output unchanged, skip writing {output_path}")
+        return False
+
+    os.replace(temp_file, output_path)
+    return True
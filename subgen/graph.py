@@ -0,0 +1,69 @@
+import hashlib
+import json
+import logging
+import marshal
+import os
+
+
+def hash_inputs(*inputs):
+    serialized = json.dumps(inputs, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+
+class GenerationGraph:
+    """
+    生成过程的依赖图: 资源 -> 节点 -> 代理组 -> 输出
+    规则数量大, 不保存在图中, 只以规则集内容的哈希参与输出节点的键
+    每个节点以输入的哈希为键保存最近一次的结果, 输入不变时直接复用
+    指定 cache_dir 时结果同时写入磁盘, 下次运行可以继续复用
+    """
+
+    def __init__(self, cache_dir=None, namespace='default'):
+        self.cache_dir = cache_dir
+        self.namespace = namespace
+        self.nodes = {}
+        self.hits = 0
+        self.misses = 0
+
+    def node_file(self, name):
+        return os.path.join(self.cache_dir, f'{self.namespace}-{name}.bin')
+
+    def get(self, name, key):
+        if name in self.nodes and self.nodes[name][0] == key:
+            return True, self.nodes[name][1]
+
+        if self.cache_dir is not None and os.path.exists(self.node_file(name)):
+            try:
+                with open(self.node_file(name), 'rb') as file:
+                    stored_key, value = marshal.load(file)
+                if stored_key == key:
+                    self.nodes[name] = (key, value)
+                    return True, value
+            except (EOFError, ValueError, TypeError) as e:
+                logging.warning(f"Invalid graph node {name}: {e}")
+
+        return False, None
+
+    def put(self, name, key, value):
+        self.nodes[name] = (key, value)
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_file = f'{self.node_file(name)}.{os.getpid()}.tmp'
+        with open(temp_file, 'wb') as file:
+            marshal.dump((key, value), file)
+        os.replace(temp_file, self.node_file(name))
+
+    def node(self, name, key, compute):
+        """输入哈希为 key 的节点, 结果过期时调用 compute 重新计算"""
+        found, value = self.get(name, key)
+        if found:
+            self.hits += 1
+            logging.debug(f"Graph node {name} is up to date")
+            return value
+
+        self.misses += 1
+        logging.debug(f"Graph node {name} is stale, recomputing")
+        value = compute()
+        self.put(name, key, value)
+        return value
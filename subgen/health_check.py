@@ -0,0 +1,109 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+from config import BASE_CONFIG_TAG
+from metrics import metrics
+from utils import CACHE_DIR
+
+HEALTH_CACHE_FILE = os.path.join(CACHE_DIR, 'health.json')
+
+
+def endpoint(proxy):
+    server = proxy.data.get('server')
+    port = proxy.data.get('port')
+    if server is None or port is None:
+        return None
+    return f'{server}:{port}'
+
+
+class HealthChecker:
+    """
+    并发 TCP 连接每个节点的 server:port, 检查节点是否可达
+    检查结果保存在 cache_file 中, ttl 秒内不重复检查, cache_file 为 None 时只保存在内存中
+    """
+
+    def __init__(self, concurrency=200, timeout=3, ttl=600, cache_file=HEALTH_CACHE_FILE):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.ttl = ttl
+        self.cache_file = cache_file
+        self.results = {}
+        if cache_file is not None and os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'r', encoding='utf-8') as file:
+                    self.results = json.load(file)
+            except ValueError as e:
+                logging.warning(f"Invalid health check cache {cache_file}: {e}")
+
+    def save(self):
+        if self.cache_file is None:
+            return
+        os.makedirs(os.path.dirname(self.cache_file) or '.', exist_ok=True)
+        temp_file = f'{self.cache_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as file:
+            json.dump(self.results, file)
+        os.replace(temp_file, self.cache_file)
+
+    async def probe(self, semaphore, target):
+        host, _, port = target.rpartition(':')
+        async with semaphore:
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection(host.strip('[]'), int(port)),
+                                                   self.timeout)
+            except (OSError, ValueError, asyncio.TimeoutError):
+                return False
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+            return True
+
+    async def probe_all(self, targets):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        return await asyncio.gather(*(self.probe(semaphore, target) for target in targets))
+
+    def check(self, proxies):
+        """返回每个 server:port 是否可达, 没有 server/port 的节点视为可达"""
+        now = time.time()
+        targets = {endpoint(proxy) for proxy in proxies} - {None}
+        expired = sorted(target for target in targets
+                         if target not in self.results or now - self.results[target][1] >= self.ttl)
+        metrics.add('health_checks_total', len(targets) - len(expired), status='cached')
+
+        if expired:
+            logging.info(f"Health checking {len(expired)} endpoints, cached: {len(targets) - len(expired)}")
+            # 不使用 asyncio.run, 关闭事件循环时不等待超时后仍在进行的 DNS 解析
+            loop = asyncio.new_event_loop()
+            try:
+                reachable = loop.run_until_complete(self.probe_all(expired))
+            finally:
+                loop.close()
+            for target, ok in zip(expired, reachable):
+                self.results[target] = [ok, now]
+                metrics.add('health_checks_total', status='reachable' if ok else 'unreachable')
+            self.save()
+
+        return {target: self.results[target][0] for target in targets}
+
+
+def is_alive(proxy, reachable):
+    # 基础配置中的节点可能被分组或规则按名称引用, 不可达时也保留
+    return proxy.tag == BASE_CONFIG_TAG or reachable.get(endpoint(proxy), True)
+
+
+def apply_health_check(proxies, reachable, action='drop'):
+    """drop: 删除不可达的节点; demote: 不可达的节点排到最后, 基础配置中的节点不受影响"""
+    alive = [proxy for proxy in proxies if is_alive(proxy, reachable)]
+    dead = [proxy for proxy in proxies if not is_alive(proxy, reachable)]
+    logging.info(f"Health check complete, reachable: {len(alive)}, unreachable: {len(dead)}, action: {action}")
+    if action == 'drop':
+        return alive
+    elif action == 'demote':
+        return alive + dead
+    else:
+        raise ValueError('Unsupported health check action: ' + action)
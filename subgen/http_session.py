@@ -0,0 +1,144 @@
+import logging
+import threading
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import metrics
+
+# 每个 host 保留的连接数, 以及连接/读取超时 (秒)
+POOL_SIZE = 10
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+# 配置了镜像时, 前一个请求超过该时间 (秒) 仍未响应则同时请求下一个镜像
+HEDGE_DELAY = 2
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def configure(pool_size=None, connect_timeout=None, read_timeout=None, hedge_delay=None):
+    global POOL_SIZE, CONNECT_TIMEOUT, READ_TIMEOUT, HEDGE_DELAY
+    if pool_size is not None:
+        POOL_SIZE = pool_size
+    if connect_timeout is not None:
+        CONNECT_TIMEOUT = connect_timeout
+    if read_timeout is not None:
+        READ_TIMEOUT = read_timeout
+    if hedge_delay is not None:
+        HEDGE_DELAY = hedge_delay
+
+
+def run_daemon(fn, *args):
+    """
+    在守护线程中执行 fn, 返回 Future
+    与 ThreadPoolExecutor 不同, 进程退出时不等待未完成的请求, 超过 deadline 或对冲落后的请求不会拖住进程
+    """
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def get_session(proxy=None):
+    """每个代理共用一个 keep-alive session, session 内部按 host 维护连接池"""
+    with _sessions_lock:
+        session = _sessions.get(proxy)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            if proxy is not None:
+                session.proxies = {
+                    'http': proxy,
+                    'https': proxy
+                }
+            _sessions[proxy] = session
+        return session
+
+
+def get(url, proxy=None, headers=None):
+    return get_session(proxy).get(url, headers=headers, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+
+
+def hedged_get(urls, proxy=None, headers=None, headers_url=None):
+    """
+    依次向各个镜像发出请求, 返回最先成功的响应及其 URL
+    前一个请求 HEDGE_DELAY 秒内没有响应, 或者已经失败时, 立即请求下一个镜像
+    headers_url 不为空时 headers 只发送给该 URL, 例如 ETag 只对签发它的源有效
+    """
+    def url_headers(url):
+        return headers if headers_url is None or url == headers_url else None
+
+    if len(urls) == 1:
+        return get(urls[0], proxy, url_headers(urls[0])), urls[0]
+
+    remaining = list(urls)
+    running = {}
+    last_response = None
+    last_error = None
+    # 落后的请求在守护线程中结束, 返回后不再等待
+    while remaining or running:
+        if remaining:
+            url = remaining.pop(0)
+            if running:
+                logging.info(f"Hedging request to mirror: {url}")
+                metrics.add('hedged_requests_total')
+            running[run_daemon(get, url, proxy, url_headers(url))] = url
+
+        done, _ = wait(running, timeout=HEDGE_DELAY if remaining else None, return_when=FIRST_COMPLETED)
+        for future in done:
+            url = running.pop(future)
+            try:
+                response = future.result()
+            except requests.exceptions.RequestException as e:
+                logging.warning(f"Mirror request failed: {url}, {e}")
+                last_error = e
+                continue
+            if response.ok:
+                return response, url
+            logging.warning(f"Mirror request failed: {url}, status: {response.status_code}")
+            last_response = (response, url)
+
+    if last_response is not None:
+        return last_response
+    raise last_error
+
+
+def connection_stats():
+    """统计所有连接池新建的连接数和发出的请求数"""
+    connections = 0
+    request_count = 0
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+    for session in sessions:
+        adapter = session.get_adapter('https://')
+        managers = [adapter.poolmanager] + list(adapter.proxy_manager.values())
+        for manager in managers:
+            for key in manager.pools.keys():
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                connections += pool.num_connections
+                request_count += pool.num_requests
+    return {
+        'connections': connections,
+        'requests': request_count,
+        'reused': max(request_count - connections, 0)
+    }
+
+
+def log_connection_stats():
+    stats = connection_stats()
+    logging.info(f"HTTP requests: {stats['requests']}, new connections: {stats['connections']}, "
+                 f"reused: {stats['reused']}")
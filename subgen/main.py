@@ -1,9 +1,16 @@
-import yaml
 import logging
 import os
 import argparse
+import http_session
+from batch import run_batch
 from config import Config
-from config import Proxy
+from generator import generate_file, read_base_config
+from graph import GenerationGraph
+from metrics import metrics, start_profiling, stop_profiling
+from server import GenerationServer
+from simulator import run_simulation
+from snapshot import write_snapshot
+from utils import CACHE_DIR, calculate_url_hash, use_snapshot, keep_loaded_content
 
 if __name__ == '__main__':
     # 创建一个ArgumentParser对象
@@ -11,9 +18,32 @@ if __name__ == '__main__':
 
     # 添加命令行参数
     parser.add_argument('-c', '--config', help='Generation config file path')
-    parser.add_argument('-o', '--output', help='Output file path')
+    parser.add_argument('-o', '--output', help='Output file path, also rewritten on every regeneration in serve mode')
     parser.add_argument('-b', '--base', help='Base config file path')
     parser.add_argument('--loglevel', help='Log level', default='INFO')
+    parser.add_argument('--optimize-rules', action='store_true',
+                        help='Remove shadowed rules and merge CIDRs before writing; '
+                             'this keeps the full rule list in memory instead of streaming it')
+    parser.add_argument('--rule-provider-dir',
+                        help='Write remote rulesets as rule-provider files into this directory')
+    parser.add_argument('--rule-provider-url',
+                        help='URL prefix the rule-provider files are served from')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Reuse unchanged intermediate results from the previous run')
+    parser.add_argument('--metrics', help='Write run metrics to this file')
+    parser.add_argument('--metrics-format', help='Metrics file format', choices=['json', 'prometheus'],
+                        default='json')
+    parser.add_argument('--profile', help='Profile the run with cProfile/tracemalloc, save results to this directory')
+    parser.add_argument('--serve', action='store_true',
+                        help='Keep running and serve the generated config over HTTP')
+    parser.add_argument('--host', help='Listen address in serve mode', default='127.0.0.1')
+    parser.add_argument('--port', help='Listen port in serve mode', type=int, default=8080)
+    parser.add_argument('--batch', help='Generate every profile listed in this manifest file')
+    parser.add_argument('--snapshot', help='Read every subscription and ruleset from this snapshot file')
+    parser.add_argument('--export-snapshot', help='Write every loaded subscription and ruleset to this snapshot file')
+    parser.add_argument('--simulate',
+                        help='Replay a trace of domains/IPs against the generated rules instead of writing a config, '
+                             'per-query results are written to the output path if given')
 
     # 解析命令行参数
     args = parser.parse_args()
@@ -25,51 +55,97 @@ if __name__ == '__main__':
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
 
+    if args.snapshot is not None:
+        if not os.path.exists(args.snapshot):
+            logging.error("Invalid snapshot file path.")
+            exit(1)
+        try:
+            use_snapshot(args.snapshot)
+        except ValueError as e:
+            logging.error(e)
+            exit(1)
+
+    if args.export_snapshot is not None:
+        if args.batch is not None:
+            logging.error("--export-snapshot is not supported with --batch.")
+            exit(1)
+        # 导出的快照使用本次加载并解析的内容, 需要在加载前开启
+        keep_loaded_content()
+
+    profiler = None
+    if args.profile is not None:
+        profiler = start_profiling()
+
+    # 批量模式, 清单中的所有配置共享订阅和规则集的加载结果
+    if args.batch is not None:
+        if not os.path.exists(args.batch):
+            logging.error("Invalid batch manifest path.")
+            exit(1)
+        run_batch(args.batch, args.incremental)
+        http_session.log_connection_stats()
+        if profiler is not None:
+            stop_profiling(profiler, args.profile)
+        if args.metrics is not None:
+            metrics.write(args.metrics, args.metrics_format)
+        exit(0)
+
     if args.config is None or not os.path.exists(args.config):
         logging.error("Invalid config file path.")
         exit(1)
 
-    if args.output is None:
+    if args.output is None and not args.serve and args.simulate is None:
         logging.error("Invalid output file path.")
         exit(1)
 
-    if args.base is None or not os.path.exists(args.base):
+    if args.simulate is not None and not os.path.exists(args.simulate):
+        logging.error("Invalid trace file path.")
+        exit(1)
+
+    if args.simulate is None and (args.base is None or not os.path.exists(args.base)):
         logging.error("Invalid config file base path.")
         exit(1)
 
     # 读取配置文件
     generation_config = Config(args.config)
+    http_session.log_connection_stats()
 
-    # 提取节点信息
-    all_proxies = [Proxy(subscription.tag, proxy['name'], proxy)
-                   for subscription in generation_config.subscriptions
-                   for proxy in subscription.data
-                   ]
+    if args.export_snapshot is not None:
+        write_snapshot(args.export_snapshot,
+                       [resource.snapshot_entry() for resource in generation_config.resources()])
 
-    # 读取基础配置
-    base_config = None
-    with open(args.base, 'r') as file:
-        base_config = yaml.safe_load(file)
+    # 模拟模式, 用生成的规则回放域名/IP 列表, 不生成配置
+    if args.simulate is not None:
+        run_simulation(generation_config, args.simulate, args.output, args.optimize_rules)
+        if profiler is not None:
+            stop_profiling(profiler, args.profile)
+        if args.metrics is not None:
+            metrics.write(args.metrics, args.metrics_format)
+        exit(0)
 
-    # 节点添加基础配置节点
-    if 'proxies' in base_config:
-        all_proxies = [Proxy("", proxy['name'], proxy) for proxy in base_config['proxies']] + all_proxies
+    # 读取基础配置
+    base_config = read_base_config(args.base)
 
-    # 写入 proxies
-    base_config['proxies'] = [proxy.data for proxy in all_proxies]
+    generate_options = {
+        'optimize_rules': args.optimize_rules,
+        'rule_provider_dir': args.rule_provider_dir,
+        'rule_provider_url': args.rule_provider_url
+    }
 
-    # 生成 proxy groups
-    base_config['proxy-groups'] = []
-    for proxy_group in generation_config.proxy_groups:
-        base_config['proxy-groups'].append(proxy_group.generate(all_proxies))
+    # 常驻服务模式, 在内存中保留配置并后台刷新
+    if args.serve:
+        server = GenerationServer(generation_config, base_config, args.output, **generate_options)
+        server.serve(args.host, args.port)
+        exit(0)
 
-    # 生成 rules
-    base_config['rules'] = []
-    for ruleset in generation_config.rulesets:
-        ruleset_rules = ruleset.generate()
-        for ruleset_rule in ruleset_rules:
-            base_config['rules'].append(ruleset_rule.to_string())
+    # 增量生成时, 中间结果按输入哈希保存在缓存目录中
+    graph = None
+    if args.incremental:
+        graph = GenerationGraph(os.path.join(CACHE_DIR, 'graph'), calculate_url_hash(os.path.abspath(args.config)))
 
     # 将新生成的配置写入文件
-    with open(args.output, 'w', encoding='utf-8') as file:
-        yaml.dump(base_config, file, allow_unicode=True, sort_keys=False, Dumper=yaml.SafeDumper)
+    generate_file(generation_config, base_config, args.output, graph, **generate_options)
+
+    if profiler is not None:
+        stop_profiling(profiler, args.profile)
+    if args.metrics is not None:
+        metrics.write(args.metrics, args.metrics_format)
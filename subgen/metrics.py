@@ -0,0 +1,130 @@
+import cProfile
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PREFIX = 'subgen_'
+
+
+class Metrics:
+    """
+    运行过程中的指标: 各阶段耗时、下载字节数、缓存命中情况、节点解析结果和峰值内存
+    可以导出为 JSON 或 Prometheus 文本格式
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.types = {}
+
+    def add(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.types.setdefault(name, 'counter')
+            series = self.values.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.types.setdefault(name, 'gauge')
+            self.values.setdefault(name, {})[key] = value
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add('stage_seconds_total', time.perf_counter() - start, stage=name)
+
+    def timed(self, iterable, name):
+        # 只统计迭代器自身生成元素的耗时, 不包括使用方处理元素的时间
+        iterator = iter(iterable)
+        elapsed = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - start
+                yield item
+        finally:
+            self.add('stage_seconds_total', elapsed, stage=name)
+
+    def stage_seconds(self, name):
+        with self.lock:
+            return self.values.get('stage_seconds_total', {}).get((('stage', name),), 0.0)
+
+    def update_peak_memory(self):
+        if resource is not None:
+            # ru_maxrss 在 macOS 下的单位为字节, Linux 下为 KB
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self.set('peak_memory_bytes', max_rss if sys.platform == 'darwin' else max_rss * 1024)
+
+    def to_dict(self):
+        self.update_peak_memory()
+        with self.lock:
+            return {name: [{**dict(key), 'value': value} for key, value in series.items()]
+                    for name, series in self.values.items()}
+
+    def to_prometheus(self):
+        self.update_peak_memory()
+        lines = []
+        with self.lock:
+            for name, series in self.values.items():
+                lines.append(f'# TYPE {PREFIX}{name} {self.types[name]}')
+                for key, value in series.items():
+                    labels = ','.join(f'{label}="{escape_label(label_value)}"' for label, label_value in key)
+                    lines.append(f'{PREFIX}{name}{{{labels}}} {value}' if labels else f'{PREFIX}{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path, output_format='json'):
+        with open(path, 'w', encoding='utf-8') as file:
+            if output_format == 'prometheus':
+                file.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), file, ensure_ascii=False, indent=2)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# 全局指标实例
+metrics = Metrics()
+
+
+def start_profiling():
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profiling(profiler, output_dir):
+    """保存 cProfile 统计和 tracemalloc 内存分配最多的位置"""
+    profiler.disable()
+    os.makedirs(output_dir, exist_ok=True)
+    profiler.dump_stats(os.path.join(output_dir, 'profile.pstats'))
+
+    snapshot = tracemalloc.take_snapshot()
+    metrics.set('traced_peak_memory_bytes', tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+    with open(os.path.join(output_dir, 'memory.txt'), 'w', encoding='utf-8') as file:
+        for stat in snapshot.statistics('lineno')[:50]:
+            file.write(f'{stat}\n')
+    logging.info(f"Profile saved to {output_dir}")
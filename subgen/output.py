@@ -0,0 +1,42 @@
+import re
+from functools import lru_cache
+
+import yaml
+
+# 有 libyaml 时使用 C 实现的 emitter
+FastDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+# 规则的 "类型,参数," 部分只包含这些字符时, 可以直接作为 plain scalar 输出
+PLAIN_RULE_HEAD = re.compile(r'[A-Za-z][\w\-.:/+@=*]*(,[\w\-.:/+@=*]+)*,')
+
+
+@lru_cache(maxsize=None)
+def is_plain_target(target):
+    # 由 PyYAML 判断 "x,target" 能否不加引号输出, 结果按 target 缓存
+    dumped = yaml.dump('x,' + target, Dumper=yaml.SafeDumper, allow_unicode=True, width=2 ** 31 - 1)
+    return dumped == f'x,{target}\n...\n'
+
+
+def rule_line(rule):
+    head, sep, target = rule.rpartition(',')
+    if sep and PLAIN_RULE_HEAD.fullmatch(head + sep) and is_plain_target(target):
+        return f'- {rule}\n'
+    return yaml.dump([rule], Dumper=yaml.SafeDumper, allow_unicode=True, width=2 ** 31 - 1)
+
+
+def write_config(file, config, rules):
+    """rules 以外的部分交给 yaml.dump, rules 逐行写入, 不在内存中保留完整的规则列表"""
+    config = {key: value for key, value in config.items() if key != 'rules'}
+    # 空的 mapping 会输出为 {}, 之后不能再接 rules
+    if config:
+        yaml.dump(config, file, allow_unicode=True, sort_keys=False, Dumper=FastDumper)
+
+    rules = iter(rules)
+    first_rule = next(rules, None)
+    if first_rule is None:
+        file.write('rules: []\n')
+        return
+
+    file.write('rules:\n')
+    file.write(rule_line(first_rule))
+    file.writelines(rule_line(rule) for rule in rules)
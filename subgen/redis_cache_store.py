@@ -0,0 +1,220 @@
+import json
+import logging
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from cache_store import compress, decompress, compression_setting
+
+# 只有持有者才能释放锁, 避免锁过期后被其他主机重新获取时误删
+RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisConnection:
+    """最小的 RESP 协议客户端, 只实现缓存需要的命令"""
+
+    def __init__(self, host, port, password=None, db=0, timeout=10):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.reader = self.sock.makefile('rb')
+        try:
+            if password is not None:
+                self.execute('AUTH', password)
+            if db:
+                self.execute('SELECT', db)
+        except Exception:
+            self.close()
+            raise
+
+    @staticmethod
+    def encode(args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    def read_reply(self):
+        line = self.reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError("Redis connection closed")
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b'+':
+            return payload.decode('utf-8')
+        if prefix == b'-':
+            raise RedisError(payload.decode('utf-8'))
+        if prefix == b':':
+            return int(payload)
+        if prefix == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError("Redis connection closed")
+            return data[:-2]
+        if prefix == b'*':
+            count = int(payload)
+            if count < 0:
+                return None
+            return self.read_replies(count)
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+    def read_replies(self, count):
+        """读取 count 个回复, 其中有错误时读取完所有回复后再抛出, 保证连接上的回复不错位"""
+        replies = []
+        error = None
+        for _ in range(count):
+            try:
+                replies.append(self.read_reply())
+            except RedisError as e:
+                replies.append(None)
+                error = error or e
+        if error is not None:
+            raise error
+        return replies
+
+    def execute(self, *args):
+        return self.pipeline([args])[0]
+
+    def pipeline(self, commands):
+        """一次发送多个命令, 按顺序返回结果"""
+        self.sock.sendall(b''.join(self.encode(args) for args in commands))
+        return self.read_replies(len(commands))
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+class RedisCacheStore:
+    """
+    保存在 Redis 中的共享缓存, 接口与 CacheStore 相同, 多台主机共用同一份下载结果
+    - <prefix><key> 保存 JSON 头和内容, <prefix><key>:time 保存下载或验证的时间
+    - 刷新资源前用 SET NX PX 获取租约, 同一时间只有一台主机下载, 其他主机等待结果
+    - 等待超过 lock_wait 秒时 lock 返回 False, 调用方可以改用旧数据
+    - 容量由 Redis 的 maxmemory 策略控制, 可以用 ttl 设置条目的过期时间
+    """
+
+    def __init__(self, url='redis://127.0.0.1:6379/0', prefix='subgen:', compression=None, ttl=None,
+                 lock_ttl=120, lock_wait=30):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or '127.0.0.1'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.prefix = prefix
+        self.compression = compression
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.lock_wait = lock_wait
+        self.local = threading.local()
+
+    def configure(self, max_size=None, compression=None):
+        # max_size 只对本地目录有效
+        if compression is not None:
+            self.compression = compression_setting(compression)
+
+    def connection(self):
+        # 每个线程使用自己的连接
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = RedisConnection(self.host, self.port, self.password, self.db)
+            self.local.connection = connection
+        return connection
+
+    def close_connection(self):
+        connection = getattr(self.local, 'connection', None)
+        self.local.connection = None
+        if connection is not None:
+            try:
+                connection.close()
+            except OSError:
+                pass
+
+    def execute(self, *commands):
+        try:
+            return self.connection().pipeline(commands)
+        except (OSError, ConnectionError):
+            # 连接断开或超时后关闭旧连接, 重连一次
+            self.close_connection()
+            return self.connection().pipeline(commands)
+
+    def entry_key(self, key):
+        return self.prefix + key
+
+    def expire_args(self):
+        return ['EX', self.ttl] if self.ttl is not None else []
+
+    def age(self, key):
+        fetched_time = self.execute(('GET', self.entry_key(key) + ':time'))[0]
+        if fetched_time is None:
+            return None
+        return time.time() - float(fetched_time)
+
+    def read_entry(self, key):
+        value = self.execute(('GET', self.entry_key(key)))[0]
+        if value is None:
+            return None, None
+        header_line, _, body = value.partition(b'\n')
+        header = json.loads(header_line)
+        return decompress(body, header.get('compression')).decode('utf-8'), header
+
+    def read(self, key):
+        return self.read_entry(key)[0]
+
+    def read_meta(self, key):
+        header_line = self.execute(('GETRANGE', self.entry_key(key), 0, 4095))[0]
+        if not header_line:
+            return {}
+        if b'\n' not in header_line:
+            # 头部超过读取的长度
+            return self.read_entry(key)[1] or {}
+        return json.loads(header_line.partition(b'\n')[0])
+
+    def write(self, key, data, meta):
+        header = {**meta, 'compression': self.compression}
+        value = json.dumps(header).encode() + b'\n' + compress(data, self.compression)
+        entry_key = self.entry_key(key)
+        # 内容和时间在同一个事务中写入
+        self.execute(
+            ('MULTI',),
+            ('SET', entry_key, value, *self.expire_args()),
+            ('SET', entry_key + ':time', time.time(), *self.expire_args()),
+            ('EXEC',)
+        )
+
+    def touch(self, key):
+        entry_key = self.entry_key(key)
+        commands = [('SET', entry_key + ':time', time.time(), *self.expire_args())]
+        if self.ttl is not None:
+            commands.append(('EXPIRE', entry_key, self.ttl))
+        self.execute(*commands)
+
+    @contextmanager
+    def lock(self, key):
+        """获取刷新该资源的租约, 返回是否获取成功"""
+        lock_key = self.entry_key(key) + ':lock'
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_wait
+        acquired = False
+        while True:
+            if self.execute(('SET', lock_key, token, 'NX', 'PX', int(self.lock_ttl * 1000)))[0] is not None:
+                acquired = True
+                break
+            if time.monotonic() >= deadline:
+                logging.info(f"Waiting for cache lease timed out: {key}")
+                break
+            time.sleep(0.2)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self.execute(('EVAL', RELEASE_SCRIPT, 1, lock_key, token))
@@ -0,0 +1,128 @@
+import bisect
+import ipaddress
+import logging
+
+from config import Rule
+
+# 字典树节点中的标记键, 不会与域名标签冲突
+SUFFIX = None
+EXACT = 0
+
+
+class DomainTrie:
+    """按倒序标签存储域名, 例如 www.google.com 存为 com -> google -> www"""
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, domain, suffix):
+        node = self.root
+        for label in reversed(domain.split('.')):
+            node = node.setdefault(label, {})
+        node[SUFFIX if suffix else EXACT] = True
+
+    def covers(self, domain, suffix):
+        # 路径上任意一个 DOMAIN-SUFFIX 都能覆盖该域名, DOMAIN 只能覆盖完全相同的 DOMAIN
+        node = self.root
+        for label in reversed(domain.split('.')):
+            node = node.get(label)
+            if node is None:
+                return False
+            if SUFFIX in node:
+                return True
+        return not suffix and EXACT in node
+
+
+class RangeSet:
+    """有序且互不重叠的整数区间, 相邻或重叠的区间在插入时合并"""
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+
+    def covers(self, start, end):
+        index = bisect.bisect_right(self.starts, start) - 1
+        return index >= 0 and self.ends[index] >= end
+
+    def add(self, start, end):
+        low = bisect.bisect_left(self.ends, start - 1)
+        high = bisect.bisect_right(self.starts, end + 1)
+        if low < high:
+            start = min(start, self.starts[low])
+            end = max(end, self.ends[high - 1])
+        self.starts[low:high] = [start]
+        self.ends[low:high] = [end]
+
+
+def parse_network(rule):
+    try:
+        return ipaddress.ip_network(rule.param, strict=False)
+    except ValueError:
+        return None
+
+
+def merge_networks(run):
+    # 连续且目标相同的 IP 规则之间顺序无关, 可以合并相邻或包含的网段
+    networks = [network for _, network in run]
+    merged = list(ipaddress.collapse_addresses(n for n in networks if n.version == 4)) + \
+        list(ipaddress.collapse_addresses(n for n in networks if n.version == 6))
+    if len(merged) == len(run):
+        return [rule for rule, _ in run]
+
+    target = run[0][0].target
+    return [Rule('IP-CIDR' if network.version == 4 else 'IP-CIDR6', str(network), target) for network in merged]
+
+
+def compact_rules(rules):
+    """
+    删除不可能被匹配到的规则并合并网段, 保持第一条匹配的语义不变
+    返回新的规则列表和删除的规则数量, 结果列表完整保存在内存中
+    """
+    domains = DomainTrie()
+    ranges = {4: RangeSet(), 6: RangeSet()}
+    result = []
+    run = []
+    matched_all = False
+    total = 0
+
+    for rule in rules:
+        total += 1
+        # MATCH 之后的规则都不会被匹配
+        if matched_all:
+            continue
+
+        network = parse_network(rule) if rule.rule_type in ('IP-CIDR', 'IP-CIDR6') else None
+        if network is not None:
+            start = int(network.network_address)
+            end = int(network.broadcast_address)
+            if ranges[network.version].covers(start, end):
+                continue
+            ranges[network.version].add(start, end)
+
+            if run and run[0][0].target != rule.target:
+                result.extend(merge_networks(run))
+                run = []
+            run.append((rule, network))
+            continue
+
+        if run:
+            result.extend(merge_networks(run))
+            run = []
+
+        if rule.rule_type in ('DOMAIN', 'DOMAIN-SUFFIX'):
+            domain = rule.param.lower()
+            suffix = rule.rule_type == 'DOMAIN-SUFFIX'
+            if domains.covers(domain, suffix):
+                continue
+            domains.add(domain, suffix)
+        elif rule.rule_type == 'MATCH':
+            matched_all = True
+
+        result.append(rule)
+
+    if run:
+        result.extend(merge_networks(run))
+
+    removed = total - len(result)
+    logging.info(f"Rule optimization complete, removed {removed} of {total} rules")
+    return result, removed
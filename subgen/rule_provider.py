@@ -0,0 +1,67 @@
+import hashlib
+import logging
+import os
+
+import yaml
+
+from config import Rule
+from output import FastDumper
+
+# 规则集类型与 rule-providers behavior 的对应关系
+BEHAVIORS = {
+    'domain': 'domain',
+    'ipcidr': 'ipcidr',
+    'classic': 'classical'
+}
+
+
+def write_rule_providers(rulesets, provider_dir, output_dir, url_prefix=None):
+    """
+    将每个远程规则集写入单独的文件, 文件名由内容哈希决定, 内容不变时文件名不变
+    返回 rule-providers 配置, 以及与 rulesets 一一对应的 provider 名称 (内联输出的规则集为 None)
+    """
+    providers = {}
+    names = []
+    os.makedirs(provider_dir, exist_ok=True)
+
+    for ruleset in rulesets:
+        behavior = BEHAVIORS.get(ruleset.rules_type)
+        if ruleset.url is None or behavior is None:
+            names.append(None)
+            continue
+
+        content = yaml.dump({'payload': list(ruleset.data)}, allow_unicode=True, sort_keys=False, Dumper=FastDumper)
+        name = f'{behavior}-{hashlib.sha256(content.encode()).hexdigest()[:16]}'
+        file_name = f'{name}.yaml'
+        provider_file = os.path.join(provider_dir, file_name)
+        if not os.path.exists(provider_file):
+            temp_file = f'{provider_file}.{os.getpid()}.tmp'
+            with open(temp_file, 'w', encoding='utf-8') as file:
+                file.write(content)
+            os.replace(temp_file, provider_file)
+            logging.info(f"Rule provider written: {provider_file}, source: {ruleset.url}")
+        else:
+            logging.info(f"Rule provider unchanged: {provider_file}, source: {ruleset.url}")
+
+        provider = {
+            'type': 'file',
+            'behavior': behavior,
+            'path': './' + os.path.relpath(provider_file, output_dir).replace(os.sep, '/')
+        }
+        if url_prefix is not None:
+            provider['type'] = 'http'
+            provider['url'] = url_prefix.rstrip('/') + '/' + file_name
+            provider['interval'] = ruleset.cache
+        providers[name] = provider
+        names.append(name)
+
+    return providers, names
+
+
+def provider_rules(rulesets, names):
+    # 写入 provider 的规则集只输出一条 RULE-SET 规则
+    for ruleset, name in zip(rulesets, names):
+        if name is None:
+            yield from ruleset.generate()
+        else:
+            yield Rule('RULE-SET', name, ruleset.target)
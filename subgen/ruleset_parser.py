@@ -0,0 +1,97 @@
+import io
+import logging
+import re
+
+import yaml
+
+from metrics import metrics
+from utils import read_yaml_string
+
+# payload 列表中的一项: 单引号、不含转义的双引号或普通值, 以及可选的行尾注释
+# 普通值不能以 YAML 的特殊字符开头, 其余情况交给 YAML 解析
+PAYLOAD_ITEM = re.compile(
+    r"""-[ \t]+(?:'((?:[^']|'')*)'|"([^"\\]*)"|([^-?:,\[\]{}#&*!|>'"%@`\s][^#]*?))(?:[ \t]+#.*)?"""
+)
+# 用于判断普通值是否会被 YAML 解析为字符串以外的类型 (null、布尔值、数字等)
+RESOLVER = yaml.resolver.Resolver()
+STR_TAG = 'tag:yaml.org,2002:str'
+# 纯文本列表中出现这些内容时说明文件是 YAML
+YAML_LINE = re.compile(r'---|\.\.\.|%|- |[^\s:]+:(?:\s|$)')
+
+
+class UnsupportedLayout(ValueError):
+    pass
+
+
+def iter_lines(content):
+    # 逐行读取, 跳过空行和注释, 保留行首的缩进
+    for line in io.StringIO(content):
+        line = line.rstrip()
+        if line != '' and not line.lstrip().startswith('#'):
+            yield line
+
+
+def payload_value(line):
+    match = PAYLOAD_ITEM.fullmatch(line)
+    if match is None:
+        raise UnsupportedLayout(line)
+    single_quoted, double_quoted, plain = match.groups()
+    if single_quoted is not None:
+        return single_quoted.replace("''", "'")
+    if double_quoted is not None:
+        return double_quoted
+    if ': ' in plain or plain.endswith(':') or RESOLVER.resolve(yaml.ScalarNode, plain, (True, False)) != STR_TAG:
+        raise UnsupportedLayout(line)
+    return plain
+
+
+def iter_payload(lines):
+    """只有一个 payload 列表的简单 YAML, 每行一项, 所有项的缩进相同"""
+    indent = None
+    for line in lines:
+        item = line.lstrip(' ')
+        # 缩进不同的行可能是上一项的续行或嵌套的列表, 制表符不能用于缩进
+        if indent is None:
+            indent = len(line) - len(item)
+        if not item.startswith('-') or len(line) - len(item) != indent:
+            raise UnsupportedLayout(line)
+        yield payload_value(item)
+
+
+def iter_text(lines):
+    """纯文本列表, 每行一项"""
+    for line in lines:
+        line = line.strip()
+        if YAML_LINE.match(line):
+            raise UnsupportedLayout(line)
+        yield line
+
+
+def parse_payload(content):
+    lines = iter_lines(content)
+    first = next(lines, None)
+    if first is None:
+        return [], 'text'
+    if first.startswith((' ', '\t')):
+        # 第一行有缩进时不按 payload 列表解析, 纯文本以外的内容交给 YAML
+        return list(iter_text([first])) + list(iter_text(lines)), 'text'
+    if first == 'payload:' or re.fullmatch(r'payload:[ \t]+#.*', first):
+        return list(iter_payload(lines)), 'payload'
+    if first.startswith('payload:'):
+        raise UnsupportedLayout(first)
+    return list(iter_text([first])) + list(iter_text(lines)), 'text'
+
+
+def parse(content, url):
+    """
+    解析规则集内容, 返回规则列表
+    简单的 payload 列表和纯文本列表逐行解析, 其他格式使用 YAML 解析
+    """
+    try:
+        data, layout = parse_payload(content)
+    except UnsupportedLayout as e:
+        logging.info(f"Ruleset {url} is not a simple list ({str(e)[:50]}), parsing as YAML")
+        data, layout = read_yaml_string(content)['payload'], 'yaml'
+    metrics.add('rulesets_parsed_total', layout=layout)
+    logging.info(f"Ruleset parsed: {url}, layout: {layout}, entries: {len(data)}")
+    return data
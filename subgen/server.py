@@ -0,0 +1,158 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from generator import generate
+from graph import GenerationGraph
+from metrics import metrics
+
+# 资源刷新失败后的重试间隔 (秒), 连续失败时加倍, 最长为资源自己的 cache 时间
+RETRY_DELAY = 60
+# 输入未变化时也定期重新生成 (秒), 健康检查的结果随时间变化, 启用时使用健康检查的 ttl
+REGENERATE_INTERVAL = 600
+
+
+class GenerationServer:
+    """
+    常驻内存的生成服务, 保留已加载的配置、订阅和规则集
+    后台按每个资源自己的 cache 时间刷新, 内容变化时或每隔 regenerate_interval 秒重新生成, 请求只读取内存中的结果
+    output_path 不为空时每次生成后同时写入该文件, 规则集 provider 的相对路径相对于该文件所在目录
+    """
+
+    def __init__(self, generation_config, base_config, output_path=None, **generate_options):
+        self.config = generation_config
+        self.base_config = base_config
+        self.output_path = output_path
+        self.output_dir = os.path.dirname(os.path.abspath(output_path)) if output_path is not None else os.getcwd()
+        self.generate_options = generate_options
+        # 只在内存中保存依赖图, 资源变化时只重新计算受影响的部分
+        self.graph = GenerationGraph()
+        self.lock = threading.Lock()
+        self.body = None
+        self.etag = None
+        now = time.time()
+        # 启动时加载的可能是已经缓存了一段时间的内容, 按缓存条目的年龄安排第一次刷新
+        self.next_refresh = {id(resource): now + resource.remaining_cache_time()
+                             for resource in self.config.resources()}
+        self.failures = Counter()
+        health_check = self.config.health_check
+        self.regenerate_interval = health_check.get('ttl', 600) if health_check.get('enabled', False) \
+            else REGENERATE_INTERVAL
+        self.next_regenerate = None
+        self.regenerate()
+
+    def regenerate(self):
+        buffer = io.StringIO()
+        generate(self.config, self.base_config, buffer, self.output_dir, graph=self.graph, **self.generate_options)
+        body = buffer.getvalue().encode('utf-8')
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        with self.lock:
+            changed = etag != self.etag
+            self.body = body
+            self.etag = etag
+        self.next_regenerate = time.time() + self.regenerate_interval
+        logging.info(f"Config regenerated, size: {len(body)} bytes, etag: {etag}")
+        if self.output_path is not None and changed:
+            temp_file = f'{self.output_path}.{os.getpid()}.tmp'
+            with open(temp_file, 'wb') as file:
+                file.write(body)
+            os.replace(temp_file, self.output_path)
+
+    def latest(self):
+        with self.lock:
+            return self.body, self.etag
+
+    def refresh(self):
+        now = time.time()
+        due = [resource for resource in self.config.resources() if self.next_refresh[id(resource)] <= now]
+        changed = self.reload(due) if len(due) > 0 else []
+        if len(changed) > 0:
+            logging.info(f"{len(changed)} resources changed, regenerating")
+            self.regenerate()
+        elif time.time() >= self.next_regenerate:
+            # 健康检查的结果会变化, 输入不变时也需要定期重新生成
+            logging.info("Regenerating on schedule")
+            self.regenerate()
+
+    def reload(self, due):
+        """重新加载到期的资源并安排下一次刷新, 返回内容发生变化的资源"""
+        logging.info(f"Refreshing {len(due)} resources")
+        failed = []
+        content_hashes = [resource.content_hash for resource in due]
+        try:
+            changed = self.config.load(due)
+        except Exception as e:
+            # 逐个重新加载, 只有失败的资源稍后重试, 成功的资源此时已经写入缓存
+            logging.error(f"Refresh resources failed: {e}, retrying one by one")
+            for resource in due:
+                try:
+                    self.config.load([resource])
+                except Exception as e:
+                    logging.error(f"Refresh resource failed: {resource.url}, {e}")
+                    failed.append(resource)
+            # 批量加载失败前可能已经解析了部分资源, 按内容哈希判断哪些资源发生了变化
+            changed = [resource for resource, content_hash in zip(due, content_hashes)
+                       if resource.content_hash != content_hash]
+
+        for resource in due:
+            if resource in failed:
+                self.failures[id(resource)] += 1
+                delay = min(RETRY_DELAY * 2 ** (self.failures[id(resource)] - 1), resource.cache)
+                logging.info(f"Retrying {resource.url} in {delay}s")
+            else:
+                self.failures.pop(id(resource), None)
+                delay = resource.cache
+            self.next_refresh[id(resource)] = time.time() + delay
+        return changed
+
+    def refresh_loop(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error(f"Regenerate config failed: {e}")
+            wait_time = min(*self.next_refresh.values(), self.next_regenerate) - time.time()
+            time.sleep(min(max(wait_time, 1), 60))
+
+    def serve(self, host, port):
+        threading.Thread(target=self.refresh_loop, daemon=True).start()
+        handler = type('Handler', (ConfigRequestHandler,), {'server_state': self})
+        httpd = ThreadingHTTPServer((host, port), handler)
+        logging.info(f"Serving config on http://{host}:{port}/")
+        httpd.serve_forever()
+
+
+class ConfigRequestHandler(BaseHTTPRequestHandler):
+    server_state = None
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            body = metrics.to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        body, etag = self.server_state.latest()
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/yaml; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} - {format % args}")
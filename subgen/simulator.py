@@ -0,0 +1,224 @@
+import bisect
+import heapq
+import logging
+import socket
+from collections import Counter
+
+from generator import ruleset_rules
+from metrics import metrics
+from rule_optimizer import SUFFIX, EXACT, parse_network, compact_rules
+
+IP_RULE_TYPES = ('IP-CIDR', 'IP-CIDR6')
+DOMAIN_RULE_TYPES = ('DOMAIN', 'DOMAIN-SUFFIX')
+
+
+def parse_ip(query):
+    """返回 (版本, 整数地址), 不是 IP 地址时返回 None"""
+    try:
+        if ':' in query:
+            return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, query), 'big')
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, query), 'big')
+    except OSError:
+        return None
+
+
+class RangeTable:
+    """
+    互不重叠的整数区间表, 每个区间记录覆盖它的规则中序号最小的一条
+    由可能重叠的 (start, end, 规则序号) 构建, 查询时二分查找
+    """
+
+    def __init__(self, ranges):
+        self.starts = []
+        self.indexes = []
+        ranges = sorted(ranges)
+        points = sorted({start for start, _, _ in ranges} | {end + 1 for _, end, _ in ranges})
+        active = []
+        position = 0
+        for point in points:
+            while position < len(ranges) and ranges[position][0] <= point:
+                start, end, index = ranges[position]
+                heapq.heappush(active, (index, end))
+                position += 1
+            while active and active[0][1] < point:
+                heapq.heappop(active)
+            index = active[0][0] if active else None
+            if self.indexes and self.indexes[-1] == index:
+                continue
+            self.starts.append(point)
+            self.indexes.append(index)
+
+    def lookup(self, value):
+        position = bisect.bisect_right(self.starts, value) - 1
+        return self.indexes[position] if position >= 0 else None
+
+
+class RuleSimulator:
+    """
+    按第一条匹配的语义模拟 clash 对域名和 IP 的规则匹配
+    DOMAIN/DOMAIN-SUFFIX 编译为倒序标签的字典树, IP-CIDR/IP-CIDR6 编译为区间表,
+    DOMAIN-KEYWORD 按关键字长度查找子串
+    GEOIP、RULE-SET 等无法离线判断的规则是一道屏障: 查询在它之前没有匹配时, 结果为在该规则处无法确定
+    域名查询不做 DNS 解析, 只匹配域名类规则
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.hits = [0] * len(self.rules)
+        self.unmatched = 0
+        self.undetermined = 0
+        # 第一条无法模拟的规则, 之后的规则都无法确定是否会被匹配到
+        self.barrier = None
+        self.domains = {}
+        self.keywords = {}
+        self.match_all = None
+        ranges = {4: [], 6: []}
+        skipped = Counter()
+
+        for index, rule in enumerate(self.rules):
+            if rule.rule_type in DOMAIN_RULE_TYPES:
+                node = self.domains
+                for label in reversed(rule.param.lower().split('.')):
+                    node = node.setdefault(label, {})
+                # 同一个域名只保留最先出现的规则
+                node.setdefault(SUFFIX if rule.rule_type == 'DOMAIN-SUFFIX' else EXACT, index)
+            elif rule.rule_type in IP_RULE_TYPES:
+                network = parse_network(rule)
+                if network is None:
+                    skipped[rule.rule_type] += 1
+                    if self.barrier is None:
+                        self.barrier = index
+                    continue
+                ranges[network.version].append(
+                    (int(network.network_address), int(network.broadcast_address), index))
+            elif rule.rule_type == 'DOMAIN-KEYWORD':
+                self.keywords.setdefault(rule.param.lower(), index)
+            elif rule.rule_type == 'MATCH':
+                if self.match_all is None:
+                    self.match_all = index
+            else:
+                skipped[rule.rule_type] += 1
+                if self.barrier is None:
+                    self.barrier = index
+
+        self.ranges = {version: RangeTable(version_ranges) for version, version_ranges in ranges.items()}
+        # 关键字按长度分组, 查询时只需要在字典中查找域名中对应长度的子串
+        self.keyword_lengths = sorted({len(keyword) for keyword in self.keywords})
+        if skipped:
+            logging.info(f"Rules not simulated: {dict(skipped)}, "
+                         f"queries not matched before rule {self.barrier} are undetermined")
+        logging.info(f"Rule simulator built, rules: {len(self.rules)}, keyword rules: {len(self.keywords)}")
+
+    def match_domain(self, domain):
+        best = None
+        node = self.domains
+        labels = domain.split('.')
+        for position in range(len(labels) - 1, -1, -1):
+            node = node.get(labels[position])
+            if node is None:
+                break
+            index = node.get(SUFFIX)
+            if index is not None and (best is None or index < best):
+                best = index
+            if position == 0:
+                index = node.get(EXACT)
+                if index is not None and (best is None or index < best):
+                    best = index
+        return best
+
+    def match_keyword(self, domain, best):
+        for length in self.keyword_lengths:
+            for start in range(len(domain) - length + 1):
+                index = self.keywords.get(domain[start:start + length])
+                if index is not None and (best is None or index < best):
+                    best = index
+        return best
+
+    def match(self, query):
+        """
+        返回 (规则序号, 是否确定), 没有规则匹配时序号为 None
+        在匹配的规则之前有无法模拟的规则时, 返回该规则的序号和 False
+        """
+        address = parse_ip(query)
+        if address is not None:
+            version, value = address
+            best = self.ranges[version].lookup(value)
+        else:
+            domain = query.lower().rstrip('.')
+            best = self.match_keyword(domain, self.match_domain(domain))
+        if self.match_all is not None and (best is None or self.match_all < best):
+            best = self.match_all
+        if self.barrier is not None and (best is None or self.barrier < best):
+            return self.barrier, False
+        return best, True
+
+    def simulate(self, queries):
+        """
+        批量查询, 逐个返回 (查询, 规则, 是否确定), 同时累计每条规则的命中次数
+        无法确定时规则为挡住查询的那条无法模拟的规则, 不计入命中次数
+        """
+        for query in queries:
+            index, determined = self.match(query)
+            if not determined:
+                self.undetermined += 1
+                yield query, self.rules[index], False
+            elif index is None:
+                self.unmatched += 1
+                yield query, None, True
+            else:
+                self.hits[index] += 1
+                yield query, self.rules[index], True
+
+    def rule_hits(self):
+        return [(rule, hits) for rule, hits in zip(self.rules, self.hits) if hits > 0]
+
+    def target_hits(self):
+        targets = Counter()
+        for rule, hits in self.rule_hits():
+            targets[rule.target] += hits
+        return targets
+
+
+def read_trace(trace_path):
+    """每行一个域名或 IP, 忽略空行和 # 开头的注释"""
+    with open(trace_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if line != '' and not line.startswith('#'):
+                yield line
+
+
+def run_simulation(generation_config, trace_path, output_path=None, optimize_rules=False):
+    """用配置生成的规则回放 trace, 结果写入 output_path, 每条规则的命中次数记录到指标中"""
+    rules = ruleset_rules(generation_config.rulesets)
+    if optimize_rules:
+        rules, _ = compact_rules(rules)
+    simulator = RuleSimulator(rules)
+
+    results = simulator.simulate(read_trace(trace_path))
+    if output_path is not None:
+        with open(output_path, 'w', encoding='utf-8') as file:
+            for query, rule, determined in results:
+                if rule is None:
+                    file.write(f'{query}\t\t\n')
+                elif not determined:
+                    file.write(f'{query}\t?\tundetermined at {rule.to_string()}\n')
+                else:
+                    file.write(f'{query}\t{rule.target}\t{rule.to_string()}\n')
+    else:
+        for _ in results:
+            pass
+
+    rule_hits = simulator.rule_hits()
+    for rule, hits in rule_hits:
+        metrics.add('rule_hits_total', hits, rule=rule.to_string())
+    metrics.add('simulated_queries_total',
+                sum(hits for _, hits in rule_hits) + simulator.unmatched + simulator.undetermined)
+    metrics.add('simulated_undetermined_total', simulator.undetermined)
+
+    targets = ', '.join(f'{target}: {hits}' for target, hits in simulator.target_hits().most_common())
+    logging.info(f"Simulation complete, unmatched: {simulator.unmatched}, "
+                 f"undetermined: {simulator.undetermined}, {targets}")
+    for rule, hits in sorted(rule_hits, key=lambda item: item[1], reverse=True)[:10]:
+        logging.info(f"{hits:>10}  {rule.to_string()}")
+    return simulator
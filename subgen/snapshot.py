@@ -0,0 +1,89 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+
+# 文件格式: MAGIC, 各资源内容依次排列, JSON 索引, FOOTER (索引偏移、索引长度、MAGIC)
+MAGIC = b'SGSNAP01'
+FOOTER = struct.Struct('>QQ8s')
+
+
+def write_snapshot(path, entries):
+    """
+    将资源写入快照文件, entries 中每项包含 url、resource_type、fetched_at、etag、last_modified、content
+    索引中记录每个资源内容的位置和 sha256
+    """
+    index = {}
+    temp_file = f'{path}.{os.getpid()}.tmp'
+    with open(temp_file, 'wb') as file:
+        file.write(MAGIC)
+        for entry in entries:
+            data = entry['content'].encode('utf-8')
+            index[entry['url']] = {
+                'resource_type': entry['resource_type'],
+                'offset': file.tell(),
+                'length': len(data),
+                'fetched_at': entry['fetched_at'],
+                'etag': entry['etag'],
+                'last_modified': entry['last_modified'],
+                'sha256': hashlib.sha256(data).hexdigest()
+            }
+            file.write(data)
+        index_offset = file.tell()
+        index_data = json.dumps(index, ensure_ascii=False, sort_keys=True).encode('utf-8')
+        file.write(index_data)
+        file.write(FOOTER.pack(index_offset, len(index_data), MAGIC))
+    os.replace(temp_file, path)
+    logging.info(f"Snapshot written: {path}, resources: {len(index)}")
+
+
+class Snapshot:
+    """只读打开快照文件, 整个文件映射到内存中, 按 URL 读取资源内容"""
+
+    def __init__(self, path):
+        self.path = path
+        # 空文件无法映射, 长度不足时直接报错
+        if os.path.getsize(path) < len(MAGIC) + FOOTER.size:
+            raise ValueError(f"Invalid snapshot file: {path}, file is empty or truncated")
+        with open(path, 'rb') as file:
+            self.mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.index = self.read_index()
+        except ValueError:
+            self.mapped.close()
+            raise
+        logging.info(f"Using snapshot: {path}, resources: {len(self.index)}")
+
+    def read_index(self):
+        size = len(self.mapped)
+        index_offset, index_length, magic = FOOTER.unpack(self.mapped[-FOOTER.size:])
+        if self.mapped[:len(MAGIC)] != MAGIC or magic != MAGIC:
+            raise ValueError(f"Invalid snapshot file: {self.path}, bad magic, not a snapshot or truncated")
+        index_end = index_offset + index_length
+        if index_offset < len(MAGIC) or index_end != size - FOOTER.size:
+            raise ValueError(f"Invalid snapshot file: {self.path}, index out of bounds")
+        try:
+            index = json.loads(self.mapped[index_offset:index_end])
+        except ValueError as e:
+            raise ValueError(f"Invalid snapshot file: {self.path}, corrupted index: {e}")
+        for url, entry in index.items():
+            if entry['offset'] < len(MAGIC) or entry['offset'] + entry['length'] > index_offset:
+                raise ValueError(f"Invalid snapshot file: {self.path}, content out of bounds: {url}")
+        return index
+
+    def entry(self, url):
+        entry = self.index.get(url)
+        if entry is None:
+            raise ValueError(f"Resource not in snapshot {self.path}: {url}")
+        return entry
+
+    def read(self, url):
+        entry = self.entry(url)
+        start = entry['offset']
+        with memoryview(self.mapped) as view:
+            return str(view[start:start + entry['length']], 'utf-8')
+
+    def close(self):
+        self.mapped.close()
@@ -1,31 +1,151 @@
+import atexit
 import logging
-from url_processor import processors
-from urllib.parse import urlparse, parse_qs
-from utils import decode_base64
+import threading
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+from metrics import metrics
+from url_processor import processors, NodeCheckError
+from utils import iter_base64_lines
 
+# 大于 1 时使用多进程解析, 订阅按 BATCH_SIZE 行分批
+PARSE_WORKERS = 1
+BATCH_SIZE = 5000
 
-def parse_sub_url(url):
-    parsed_url = urlparse(url)
-    query = parse_qs(parsed_url.query)
+# 同时提交到进程池的批次数为进程数的 IN_FLIGHT_FACTOR 倍, 其余批次在前面的批次完成后再读取
+IN_FLIGHT_FACTOR = 2
 
-    processor = processors.get(parsed_url.scheme)
-    node = processor.process(url, parsed_url, query)
+_pool = None
+_pool_lock = threading.Lock()
 
-    if node is not None:
-        logging.info(f'Successfully parsed {parsed_url.scheme} node {node["name"]}')
+# 与 urlsplit 一致, 取 scheme 前去掉开头的空白和控制字符
+URL_LEADING_CHARS = ''.join(chr(code) for code in range(0x21))
+
+
+def configure(workers=None, batch_size=None):
+    global PARSE_WORKERS, BATCH_SIZE
+    if workers is not None and workers != PARSE_WORKERS:
+        PARSE_WORKERS = workers
+        # 进程数变化后关闭旧的进程池, 下次使用时按新的进程数创建
+        shutdown_pool()
+    if batch_size is not None:
+        BATCH_SIZE = batch_size
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+        return _pool
+
+
+@atexit.register
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+
+
+def parse_sub_url(url, stats, rejections):
+    # scheme 不区分大小写, 没有 scheme 时为空字符串
+    scheme, separator, _ = url.lstrip(URL_LEADING_CHARS).partition(':')
+    scheme = scheme.lower() if separator else ''
+    processor = processors.get(scheme)
+    if processor is None:
+        stats[(scheme, 'unsupported')] += 1
+        logging.debug(f'Unsupported node type: {scheme}')
+        return None
+
+    try:
+        node = processor.process(url)
+    except NodeCheckError as e:
+        stats[(scheme, 'rejected')] += 1
+        rejections.append((e.node.get('name'), str(e)))
+        return None
+
+    stats[(scheme, 'accepted')] += 1
     return node
 
 
+def iter_lines(raw_sub):
+    return (line for line in metrics.timed(iter_base64_lines(raw_sub), 'decode') if line != '')
+
+
+def iter_nodes(lines, stats, rejections):
+    # 节点按需生成
+    for line in lines:
+        node = parse_sub_url(line, stats, rejections)
+        if node is not None:
+            yield node
+
+
+def parse_batch(lines):
+    stats = Counter()
+    rejections = []
+    nodes = list(iter_nodes(lines, stats, rejections))
+    return nodes, stats, rejections
+
+
+def iter_batches(lines, batch_size):
+    while True:
+        batch = list(islice(lines, batch_size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+
+def map_batches(pool, batches, in_flight):
+    """按顺序返回每批的解析结果, 最多 in_flight 批同时在进程池中, 不会一次读入所有批次"""
+    pending = deque()
+    for batch in batches:
+        if len(pending) >= in_flight:
+            yield pending.popleft().result()
+        pending.append(pool.submit(parse_batch, batch))
+    while pending:
+        yield pending.popleft().result()
+
+
+def record_stats(stats):
+    """按处理器记录节点数, 解析缓存命中时使用缓存中保存的统计"""
+    for (scheme, status), count in stats.items():
+        metrics.add('nodes_total', count, processor=scheme, status=status)
+
+
 def parse(raw_sub, url):
+    return parse_with_stats(raw_sub, url)[0]
+
+
+def parse_with_stats(raw_sub, url):
+    """返回节点列表和每个处理器的 (scheme, status) 计数"""
     logging.info(f'Processing subscription: {url}')
-    decoded = decode_base64(raw_sub)
-    lines = decoded.split('\n')
-    nodes = []
-    for line in lines:
-        if line != '':
-            node = parse_sub_url(line)
-            if node is not None:
-                nodes.append(node)
+    stats = Counter()
+    rejections = []
+    lines = iter_lines(raw_sub)
+
+    batches = iter_batches(lines, BATCH_SIZE) if PARSE_WORKERS > 1 else iter([])
+    first_batch = next(batches, None)
+    second_batch = next(batches, None)
+    if second_batch is None:
+        # 只有一批时不值得使用多进程
+        nodes = list(iter_nodes(first_batch if first_batch is not None else lines, stats, rejections))
+    else:
+        # 多进程解析, 按原始顺序合并结果
+        nodes = []
+        logging.info(f'Parsing batches of {BATCH_SIZE} lines with {PARSE_WORKERS} processes')
+        all_batches = chain([first_batch, second_batch], batches)
+        results = map_batches(get_pool(), all_batches, PARSE_WORKERS * IN_FLIGHT_FACTOR)
+        for batch_nodes, batch_stats, batch_rejections in results:
+            nodes.extend(batch_nodes)
+            stats.update(batch_stats)
+            rejections.extend(batch_rejections)
+
+    for name, reason in rejections:
+        logging.info(f'{name} 节点检查失败, 原因: {reason}')
+    record_stats(stats)
 
-    logging.info(f'Subscription processing complete，total nodes: {len(nodes)}')
-    return nodes
+    summary = ', '.join(f'{scheme} {status}: {count}' for (scheme, status), count in sorted(stats.items()))
+    logging.info(f'Subscription processing complete，total nodes: {len(nodes)}, {summary}')
+    return nodes, stats
@@ -1,28 +1,37 @@
-import logging
 from abc import abstractmethod
 from urllib.parse import unquote, urlparse, parse_qs
 
 from utils import decode_base64, decode_url_base64
 
 
+class NodeCheckError(ValueError):
+    def __init__(self, node, reason):
+        super().__init__(reason)
+        self.node = node
+
+
+def parse_url(url):
+    parsed_url = urlparse(url)
+    return parsed_url, parse_qs(parsed_url.query)
+
+
 class UrlProcessor:
     @abstractmethod
     def check_data(self, node):
         pass
 
     @abstractmethod
-    def parse_node(self, url, parsed_url, query):
+    def parse_node(self, url):
         pass
 
-    def process(self, url, parsed_url, query):
-        node = self.parse_node(url, parsed_url, query)
+    def process(self, url):
+        node = self.parse_node(url)
 
         try:
             self.check_data(node)
             return node
         except ValueError as e:
-            logging.info(f'{node["name"]} 节点检查失败, 原因: {str(e)}')
-            return None
+            raise NodeCheckError(node, str(e))
 
 
 # Trojan URL 处理
@@ -36,7 +45,8 @@ class TrojanUrlProcessor(UrlProcessor):
             if node.get(key, "") == "":
                 raise ValueError(f'trojan 节点缺失 {key}')
 
-    def parse_node(self, url, parsed_url, query):
+    def parse_node(self, url):
+        parsed_url, query = parse_url(url)
         node = {
             'name': unquote(parsed_url.fragment),
             'type': 'trojan',
@@ -75,7 +85,8 @@ class ShadowsocksUrlProcessor(UrlProcessor):
 
         return True
 
-    def parse_node(self, url, parsed_url, query):
+    def parse_node(self, url):
+        parsed_url, query = parse_url(url)
         combination = decode_base64(parsed_url.username).split(':')
         node = {
             'name': unquote(parsed_url.fragment),
@@ -119,10 +130,10 @@ class ShadowsocksRUrlProcessor(UrlProcessor):
         if node['protocol'] not in self.SUPPORTED_PROTOCOLS:
             raise ValueError(f'ssr 节点不支持 protocol: {node["protocol"]}')
 
-    def parse_node(self, url, parsed_url, query):
+    def parse_node(self, url):
+        # ssr 链接的内容整体经过 base64 编码, 解码后再解析
         real_content = decode_url_base64(url[6:])
-        parsed_url = urlparse('ssr://' + real_content)
-        query = parse_qs(parsed_url.query)
+        parsed_url, query = parse_url('ssr://' + real_content)
         combination = parsed_url.netloc.split(':')
         node = {
             'name': decode_url_base64(query['remarks'][0]),
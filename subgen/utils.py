@@ -2,12 +2,80 @@ import base64
 import hashlib
 import ipaddress
 import logging
+import marshal
 import os
+import re
 import requests
+import socket
+import threading
+import time
 import yaml
-from datetime import datetime
+from collections import Counter
+from concurrent.futures import wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+
+import http_session
+from cache_store import CacheStore, evict_directory, remove_stale_temp_files
+from metrics import metrics
+from redis_cache_store import RedisCacheStore
+from snapshot import Snapshot
+
+NON_BASE64_CHARS = re.compile(r'[^A-Za-z0-9+/=]')
 
 CACHE_DIR = "cache"
+# 已解析规则集的缓存目录, 以内容哈希为键, 命中时跳过 YAML 解析
+PARSED_CACHE_DIR = os.path.join(CACHE_DIR, "parsed")
+# 解析结果的格式或解析逻辑变化时增加版本号, 使旧的解析缓存失效
+PARSED_CACHE_VERSION = 4
+# 解析缓存通过配置文件的 cache 部分设置: parsed 为 false 时关闭, parsed_max_size 为目录的大小上限 (字节)
+PARSED_CACHE_ENABLED = True
+PARSED_CACHE_MAX_SIZE = None
+
+# 下载内容的缓存, 后端、大小上限和压缩方式通过配置文件的 cache 部分设置
+cache_store = CacheStore(CACHE_DIR)
+# 使用快照时, 所有外部资源都从快照中读取, 不访问网络和缓存
+snapshot = None
+# 导出快照时每个资源保留本次加载的原始内容和校验信息, 导出的内容与解析的内容完全一致
+keep_loaded = False
+
+
+def configure_cache(cache_config):
+    """
+    backend 为 local 时使用本地缓存目录, 为 redis 时使用多台主机共享的 Redis 缓存
+    redis 后端的 url 形如 redis://:password@host:6379/0
+    """
+    global cache_store, PARSED_CACHE_ENABLED, PARSED_CACHE_MAX_SIZE
+    PARSED_CACHE_ENABLED = cache_config.get('parsed', True)
+    PARSED_CACHE_MAX_SIZE = cache_config.get('parsed_max_size')
+    backend = cache_config.get('backend', 'local')
+    if backend == 'local':
+        if not isinstance(cache_store, CacheStore):
+            cache_store = CacheStore(CACHE_DIR)
+    elif backend == 'redis':
+        cache_store = RedisCacheStore(
+            cache_config.get('url', 'redis://127.0.0.1:6379/0'),
+            cache_config.get('prefix', 'subgen:'),
+            ttl=cache_config.get('ttl'),
+            lock_ttl=cache_config.get('lock_ttl', 120),
+            lock_wait=cache_config.get('lock_wait', 30)
+        )
+    else:
+        raise ValueError('Unsupported cache backend: ' + backend)
+    cache_store.configure(cache_config.get('max_size'), cache_config.get('compression'))
+    if isinstance(cache_store, CacheStore):
+        cache_store.sweep()
+    # 解析缓存总是保存在本地目录
+    remove_stale_temp_files(PARSED_CACHE_DIR)
+
+
+def use_snapshot(path):
+    global snapshot
+    snapshot = Snapshot(path)
+
+
+def keep_loaded_content():
+    global keep_loaded
+    keep_loaded = True
 
 
 def decode_base64(encoded_str):
@@ -18,6 +86,25 @@ def decode_base64(encoded_str):
         raise e
 
 
+def iter_base64_lines(encoded_str, chunk_size=1 << 16):
+    """分块解码 base64 内容并逐行返回, 不在内存中保留完整的解码结果"""
+    pending = ''
+    tail = b''
+    for start in range(0, len(encoded_str), chunk_size):
+        # 与 b64decode 一致, 忽略非 base64 字符, 每次只解码 4 的整数倍个字符
+        chunk = pending + NON_BASE64_CHARS.sub('', encoded_str[start:start + chunk_size])
+        usable = len(chunk) - len(chunk) % 4
+        pending = chunk[usable:]
+        *lines, tail = (tail + base64.b64decode(chunk[:usable])).split(b'\n')
+        for line in lines:
+            yield line.decode('utf-8')
+
+    if pending != '':
+        tail += base64.b64decode(pending + '==')
+    for line in tail.split(b'\n'):
+        yield line.decode('utf-8')
+
+
 def decode_url_base64(encoded_str):
     try:
         decoded_bytes = base64.urlsafe_b64decode(encoded_str + '==')
@@ -26,20 +113,32 @@ def decode_url_base64(encoded_str):
         raise e
 
 
-def is_valid_ipv6(address):
+def is_valid_network(address, family, max_prefix):
+    # 常见的 地址/前缀长度 格式直接用 inet_pton 检查, 不创建 ipaddress 对象
+    ip, separator, prefix = address.partition('/')
+    if separator != '' and not (prefix.isascii() and prefix.isdigit()) or '%' in ip:
+        # 子网掩码、IPv6 scope 等少见的写法交给 ipaddress 判断
+        network_class = ipaddress.IPv4Network if family == socket.AF_INET else ipaddress.IPv6Network
+        try:
+            network_class(address, strict=False)
+            return True
+        except (ipaddress.AddressValueError, ValueError):
+            return False
+    if prefix != '' and int(prefix) > max_prefix:
+        return False
     try:
-        ipaddress.IPv6Network(address, strict=False)
+        socket.inet_pton(family, ip)
         return True
-    except (ipaddress.AddressValueError, ValueError):
+    except (OSError, ValueError):
         return False
 
 
+def is_valid_ipv6(address):
+    return is_valid_network(address, socket.AF_INET6, 128)
+
+
 def is_valid_ipv4(address):
-    try:
-        ipaddress.IPv4Network(address, strict=False)
-        return True
-    except (ipaddress.AddressValueError, ValueError):
-        return False
+    return is_valid_network(address, socket.AF_INET, 32)
 
 
 def calculate_url_hash(url):
@@ -48,6 +147,51 @@ def calculate_url_hash(url):
     return hash_object.hexdigest()
 
 
+def calculate_content_hash(content):
+    hash_object = hashlib.sha256(content.encode())
+    return hash_object.hexdigest()
+
+
+def read_parsed_cache(key):
+    # 使用快照时不读写磁盘上的解析缓存
+    if snapshot is not None or not PARSED_CACHE_ENABLED:
+        return None
+    parsed_file = os.path.join(PARSED_CACHE_DIR, f'{key}-v{PARSED_CACHE_VERSION}.bin')
+    if not os.path.exists(parsed_file):
+        return None
+    try:
+        with open(parsed_file, 'rb') as file:
+            data = marshal.load(file)
+    except (EOFError, ValueError, TypeError) as e:
+        logging.warning(f"Invalid parsed cache {parsed_file}: {e}")
+        return None
+    if PARSED_CACHE_MAX_SIZE is not None:
+        # 记录读取时间, 用于 LRU 淘汰
+        try:
+            os.utime(parsed_file)
+        except FileNotFoundError:
+            pass
+    return data
+
+
+def write_parsed_cache(key, data):
+    if snapshot is not None or not PARSED_CACHE_ENABLED:
+        return
+    parsed_file = os.path.join(PARSED_CACHE_DIR, f'{key}-v{PARSED_CACHE_VERSION}.bin')
+    try:
+        serialized = marshal.dumps(data)
+    except ValueError as e:
+        logging.warning(f"Unable to cache parsed data {key}: {e}")
+        return
+    os.makedirs(PARSED_CACHE_DIR, exist_ok=True)
+    temp_file = f'{parsed_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_file, 'wb') as file:
+        file.write(serialized)
+    os.replace(temp_file, parsed_file)
+    if PARSED_CACHE_MAX_SIZE is not None:
+        evict_directory(PARSED_CACHE_DIR, PARSED_CACHE_MAX_SIZE, '.bin', parsed_file)
+
+
 def read_yaml_string(yaml_string):
     try:
         yaml_data = yaml.safe_load(yaml_string)
@@ -58,57 +202,252 @@ def read_yaml_string(yaml_string):
 
 
 class ExternalResource:
-    def __init__(self, resource_type, url, cache_time, proxy=None):
+    def __init__(self, resource_type, url, cache_time, proxy=None, stale_time=None, mirrors=None):
         self.cache = cache_time if cache_time is not None else 86400
+        self.stale = stale_time if stale_time is not None else 0
         self.proxy = proxy
         self.resource_type = resource_type
         self.url = url
+        # 内容相同的备用地址, 缓存仍以 url 为键
+        self.mirrors = mirrors if mirrors is not None else []
+        self.content_hash = None
+        # keep_loaded 为 True 时保存最近一次加载的 (内容, 校验信息)
+        self.loaded = None
+
+    def host(self):
+        if self.resource_type != 'http' or self.url is None:
+            return None
+        return urlparse(self.url).hostname
+
+    def parse_content(self, content):
+        pass
+
+    def cache_key(self):
+        return calculate_url_hash(self.url)
+
+    def remaining_cache_time(self):
+        """距离缓存过期的秒数, 没有缓存条目时为完整的 cache 时间"""
+        if snapshot is not None or self.resource_type != 'http':
+            return self.cache
+        age = cache_store.age(self.cache_key())
+        if age is None:
+            return self.cache
+        return max(self.cache - age, 0)
+
+    def read_cache_entry(self, key):
+        """读取缓存中的内容及其下载时间和校验信息, 没有缓存时返回 (None, None)"""
+        age = cache_store.age(key)
+        content, header = cache_store.read_entry(key)
+        if content is None or age is None:
+            return None, None
+        return content, {
+            'fetched_at': time.time() - age,
+            'etag': header.get('etag'),
+            'last_modified': header.get('last_modified')
+        }
+
+    def read_fresh_cache(self, key):
+        age = cache_store.age(key)
+        if age is None or age >= self.cache:
+            return None, None
+        content, entry = self.read_cache_entry(key)
+        if content is not None:
+            logging.info(f"Using cached resource: {self.url}, cached time: {int(age)}s, cache time: {self.cache}s")
+            metrics.add('resource_cache_total', status='hit')
+        return content, entry
 
     def load(self):
+        return self.load_entry()[0]
+
+    def load_entry(self):
+        """加载资源, 返回内容及其下载时间和校验信息"""
+        if snapshot is not None:
+            entry = snapshot.entry(self.url)
+            return snapshot.read(self.url), {
+                'fetched_at': entry.get('fetched_at'),
+                'etag': entry.get('etag'),
+                'last_modified': entry.get('last_modified')
+            }
+
         if self.resource_type == 'http':
             try:
-                current_time = datetime.now()
-                url_hash = calculate_url_hash(self.url)
-                cache_file = os.path.join(CACHE_DIR, f'{url_hash}.cache')
-
-                # 检查缓存文件是否存在并且未过期
-                if os.path.exists(cache_file):
-                    cached_time = (current_time - datetime.fromtimestamp(os.path.getmtime(cache_file))).total_seconds()
-                    if cached_time < self.cache:
-                        logging.info(f"Using cached resource: {self.url}, cached time: {int(cached_time)}s, cache time: {self.cache}s")
-                        with open(cache_file, 'rb') as file:
-                            cached_data = file.read()
-                        return cached_data.decode('utf-8')
-
-                logging.info(f"Downloading resource: {self.url}")
-                proxies = None
-                if self.proxy is not None:
-                    logging.info(f"Using proxy: {self.proxy}")
-                    proxies = {
-                        'HTTP': self.proxy,
-                        'HTTPS': self.proxy
-                    }
-
-                response = requests.get(self.url, proxies=proxies)
-                response.raise_for_status()  # 检查是否下载成功
-
-                # 获取响应的二进制数据
-                downloaded_data = response.content
-
-                # 将新下载的数据写入缓存文件
-                with open(cache_file, 'wb') as file:
-                    file.write(downloaded_data)
-
-                return downloaded_data.decode('utf-8')
+                key = self.cache_key()
+
+                # 检查缓存是否存在并且未过期
+                content, entry = self.read_fresh_cache(key)
+                if content is not None:
+                    return content, entry
+
+                # 缓存已过期但仍在 stale 窗口内, 先返回旧数据, 再在后台重新验证
+                age = cache_store.age(key)
+                if age is not None and age < self.cache + self.stale:
+                    content, entry = self.read_cache_entry(key)
+                    if content is not None:
+                        logging.info(f"Using stale resource: {self.url}, cached time: {int(age)}s, revalidating in background")
+                        metrics.add('resource_cache_total', status='stale')
+                        # 守护线程不阻止进程退出, 进程在重新验证完成前退出时本次刷新会丢失, 下次运行重新验证
+                        threading.Thread(target=self.revalidate, daemon=True).start()
+                        return content, entry
+
+                with cache_store.lock(key) as acquired:
+                    # 等待锁期间其他进程或主机可能已经下载完成
+                    content, entry = self.read_fresh_cache(key)
+                    if content is not None:
+                        return content, entry
+                    # 其他主机持有租约的时间过长时使用旧数据, 没有旧数据时自己下载
+                    if not acquired:
+                        content, entry = self.read_cache_entry(key)
+                        if content is not None:
+                            logging.info(f"Cache lease held by another host, using cached resource: {self.url}")
+                            metrics.add('resource_cache_total', status='lease_timeout')
+                            return content, entry
+                    return self.download(key)
 
             except requests.exceptions.RequestException as e:
                 logging.error(f"HTTP reqeust error: {e}")
                 raise e
 
         elif self.resource_type == 'file':
+            fetched_at = os.path.getmtime(self.url)
             with open(self.url, 'rb') as file:
                 data = file.read()
-            return data.decode('utf-8')
+            return data.decode('utf-8'), {'fetched_at': fetched_at, 'etag': None, 'last_modified': None}
 
         else:
             raise ValueError(f"不支持的 type: {self.resource_type}")
+
+    def load_cached(self):
+        """不论是否过期, 返回缓存中的内容及其校验信息, 没有缓存时返回 (None, None)"""
+        if self.resource_type != 'http':
+            return None, None
+        return self.read_cache_entry(self.cache_key())
+
+    def snapshot_entry(self):
+        """本次运行加载并解析的内容及其校验信息, 用于导出快照, 需要在加载前调用 keep_loaded_content"""
+        if self.loaded is None:
+            raise ValueError(f"Resource content was not kept during loading: {self.url}")
+        content, entry = self.loaded
+        if calculate_content_hash(content) != self.content_hash:
+            raise ValueError(f"Kept content does not match the parsed content: {self.url}")
+        return {'url': self.url, 'resource_type': self.resource_type, **entry, 'content': content}
+
+    def revalidate(self):
+        try:
+            key = self.cache_key()
+            with cache_store.lock(key) as acquired:
+                # 其他主机正在刷新或已经刷新完成时不再重复下载
+                if not acquired:
+                    return
+                age = cache_store.age(key)
+                if age is not None and age < self.cache:
+                    return
+                self.download(key)
+        except Exception as e:
+            logging.error(f"Revalidate resource failed: {self.url}, {e}")
+
+    def download(self, key):
+        # 带上上次响应的 ETag / Last-Modified, 内容未变化时服务端返回 304
+        # 校验信息只对返回它的源有效, 只发送给该源, 其他镜像请求完整内容
+        headers = {}
+        meta = cache_store.read_meta(key)
+        origin = meta.get('url', self.url)
+        if 'etag' in meta:
+            headers['If-None-Match'] = meta['etag']
+        if 'last_modified' in meta:
+            headers['If-Modified-Since'] = meta['last_modified']
+
+        logging.info(f"Downloading resource: {self.url}")
+        if self.proxy is not None:
+            logging.info(f"Using proxy: {self.proxy}")
+
+        urls = [self.url] + self.mirrors
+        response, url = http_session.hedged_get(urls, self.proxy, headers, origin)
+        if url != self.url:
+            logging.info(f"Resource downloaded from mirror: {url}")
+        if response.status_code == 304 and headers:
+            content, entry = self.read_cache_entry(key)
+            if content is not None:
+                logging.info(f"Resource not modified: {self.url}")
+                metrics.add('resource_cache_total', status='not_modified')
+                cache_store.touch(key)
+                return content, {**entry, 'fetched_at': time.time()}
+            # 缓存条目在请求期间被淘汰, 重新完整下载
+            response, url = http_session.hedged_get(urls, self.proxy, {})
+
+        response.raise_for_status()  # 检查是否下载成功
+
+        # 获取响应的二进制数据
+        downloaded_data = response.content
+        metrics.add('resource_cache_total', status='miss')
+        metrics.add('download_bytes_total', len(downloaded_data), url=self.url)
+
+        # 将新下载的数据和校验信息写入缓存
+        meta = {'url': url}
+        if 'ETag' in response.headers:
+            meta['etag'] = response.headers['ETag']
+        if 'Last-Modified' in response.headers:
+            meta['last_modified'] = response.headers['Last-Modified']
+        cache_store.write(key, downloaded_data, meta)
+
+        return downloaded_data.decode('utf-8'), {
+            'fetched_at': time.time(),
+            'etag': meta.get('etag'),
+            'last_modified': meta.get('last_modified')
+        }
+
+
+def timed_load(resource):
+    start = time.perf_counter()
+    try:
+        return resource.load_entry()
+    finally:
+        metrics.set('resource_load_seconds', time.perf_counter() - start, url=resource.url)
+
+
+def load_resources(resources, max_workers=8, per_host=4, deadline=None):
+    """
+    并发加载所有外部资源, 每个 host 同时最多 per_host 个请求, 结果顺序与 resources 一致
+    deadline 秒后仍未加载完成的资源使用缓存中的旧数据, 这些下载在后台继续,
+    但进程退出时不等待, 退出前没有完成的下载不会写入缓存
+    """
+    results = [None] * len(resources)
+    pending = list(enumerate(resources))
+    running = {}
+    active = Counter()
+    end_time = time.monotonic() + deadline if deadline is not None else None
+
+    while pending or running:
+        # 按配置顺序派发, 跳过已达到并发上限的 host
+        for item in list(pending):
+            if len(running) >= max_workers:
+                break
+            index, resource = item
+            host = resource.host()
+            if host is not None and active[host] >= per_host:
+                continue
+            pending.remove(item)
+            active[host] += 1
+            running[http_session.run_daemon(timed_load, resource)] = (index, host)
+
+        timeout = max(end_time - time.monotonic(), 0) if end_time is not None else None
+        done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            index, host = running.pop(future)
+            active[host] -= 1
+            results[index] = future.result()
+
+        if end_time is not None and time.monotonic() >= end_time and (pending or running):
+            break
+
+    for index, resource in pending + [(index, resources[index]) for index, _ in running.values()]:
+        content, entry = resource.load_cached()
+        if content is None:
+            raise TimeoutError(f"Resource not loaded before deadline and not cached: {resource.url}")
+        logging.warning(f"Resource not loaded before deadline, using cached content: {resource.url}")
+        metrics.add('resource_cache_total', status='deadline')
+        results[index] = content, entry
+
+    if keep_loaded:
+        for resource, loaded in zip(resources, results):
+            resource.loaded = loaded
+    return [content for content, _ in results]
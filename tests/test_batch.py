@@ -0,0 +1,64 @@
+"""
+批量生成清单的测试, 只解析配置, 不下载资源
+    python -m pytest tests
+"""
+import json
+import logging
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'subgen'))
+
+from batch import read_manifest, resource_key  # noqa: E402
+
+
+def write_json(path, data):
+    path.write_text(json.dumps(data), encoding='utf-8')
+
+
+def profile_config(**sections):
+    return {
+        'subscriptions': [{'tag': 'A', 'url': 'http://127.0.0.1/sub.txt', 'cache': 60}],
+        'proxy_groups': [{'type': 'select', 'name': 'PROXY', 'includes': ['DIRECT']}],
+        'rulesets': [{'type': 'clash', 'url': 'http://127.0.0.1/rules.yaml', 'target': 'PROXY'}],
+        **sections
+    }
+
+
+@pytest.fixture
+def manifest(tmp_path, monkeypatch):
+    # 清单中的 cache 设置会作用于当前目录下的缓存目录
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'base.yaml').write_text('rules: []\n', encoding='utf-8')
+    write_json(tmp_path / 'one.json', profile_config())
+    write_json(tmp_path / 'two.json', profile_config(parse={'workers': 8}))
+    write_json(tmp_path / 'manifest.json', {
+        'parse': {'workers': 2},
+        'profiles': [
+            {'name': 'one', 'config': 'one.json', 'base': 'base.yaml', 'output': 'out/one.yaml'},
+            {'name': 'two', 'config': 'two.json', 'base': 'base.yaml', 'output': 'out/two.yaml'}
+        ]
+    })
+    return tmp_path / 'manifest.json'
+
+
+def test_manifest_overrides_process_settings(manifest, caplog):
+    with caplog.at_level(logging.WARNING):
+        _, profiles = read_manifest(str(manifest))
+    assert [profile.name for profile in profiles] == ['one', 'two']
+    warnings = [record.getMessage() for record in caplog.records]
+    assert len(warnings) == 1
+    assert 'Profile [two] sets parse.workers = 8' in warnings[0]
+
+
+def test_resource_key_includes_cache_times(manifest):
+    _, profiles = read_manifest(str(manifest))
+    first, second = (profile.config.subscriptions[0] for profile in profiles)
+    assert resource_key(first) == resource_key(second)
+    second.cache = 3600
+    assert resource_key(first) != resource_key(second)
+    second.cache = first.cache
+    second.stale = 600
+    assert resource_key(first) != resource_key(second)
@@ -0,0 +1,110 @@
+"""
+本地缓存目录 CacheStore 的测试
+    python -m pytest tests
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'subgen'))
+
+from cache_store import CacheStore, evict_directory  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path):
+    return CacheStore(str(tmp_path))
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_write_and_read(store, compression):
+    store.configure(compression=compression)
+    assert store.read_entry('a') == (None, None)
+    assert store.age('a') is None
+    store.write('a', '内容\n'.encode('utf-8') * 1000, {'etag': '"v1"'})
+    content, header = store.read_entry('a')
+    assert content == '内容\n' * 1000
+    assert header == {'etag': '"v1"', 'compression': compression}
+    assert store.read_meta('a') == header
+    assert 0 <= store.age('a') < 5
+
+
+def test_touch_and_read_keep_download_time(store):
+    store.write('a', b'data', {})
+    old = time.time() - 1000
+    os.utime(store.entry_file('a'), (old, old))
+    store.read('a')
+    assert store.age('a') >= 1000
+    store.touch('a')
+    assert store.age('a') < 5
+
+
+def test_evict_least_recently_read(store):
+    for index, key in enumerate(['a', 'b', 'c']):
+        store.write(key, b'x' * 1000, {})
+        os.utime(store.entry_file(key), (1000 + index, 1000 + index))
+    # 读取 a 后 b、c 最久没有被读取, 写入 d 时淘汰 b 和 c, 刚写入的条目不会被淘汰
+    store.read('a')
+    store.configure(max_size=2500)
+    store.write('d', b'x' * 1000, {})
+    assert [key for key in 'abcd' if store.read_meta(key)] == ['a', 'd']
+
+
+def test_evict_directory_keeps_recent_files(tmp_path):
+    now = time.time()
+    for position, name in enumerate(['a.bin', 'b.bin', 'c.bin']):
+        path = tmp_path / name
+        path.write_bytes(b'x' * 100)
+        os.utime(path, (now - 100 + position, now - 100 + position))
+    (tmp_path / 'other.tmp').write_bytes(b'x' * 1000)
+    # a 最久未读取, 但作为 keep_file 不会被删除
+    evict_directory(str(tmp_path), 150, '.bin', str(tmp_path / 'a.bin'))
+    assert sorted(os.listdir(tmp_path)) == ['a.bin', 'other.tmp']
+
+
+def test_lock_is_exclusive(store):
+    inside = []
+    overlaps = []
+
+    def worker():
+        for _ in range(20):
+            with store.lock('a') as acquired:
+                assert acquired
+                inside.append(1)
+                if len(inside) > 1:
+                    overlaps.append(1)
+                time.sleep(0.001)
+                inside.pop()
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert overlaps == []
+
+
+def test_sweep_migrates_legacy_files(store, tmp_path):
+    (tmp_path / 'old.cache').write_bytes(b'legacy content')
+    (tmp_path / 'old.meta').write_text(json.dumps({'etag': '"v0"'}))
+    os.utime(tmp_path / 'old.cache', (1000, 1000))
+    (tmp_path / 'orphan.meta').write_text('{}')
+    store.sweep()
+    assert store.read_entry('old') == ('legacy content', {'etag': '"v0"', 'compression': None})
+    assert store.age('old') > time.time() - 1100
+    assert not (tmp_path / 'old.cache').exists()
+    assert not (tmp_path / 'old.meta').exists()
+    assert not (tmp_path / 'orphan.meta').exists()
+
+
+def test_sweep_removes_stale_temp_files(store, tmp_path):
+    (tmp_path / 'a.entry.1.2.tmp').write_bytes(b'partial')
+    os.utime(tmp_path / 'a.entry.1.2.tmp', (1000, 1000))
+    # 较新的临时文件可能仍在被其他进程写入
+    (tmp_path / 'b.entry.1.2.tmp').write_bytes(b'writing')
+    store.sweep()
+    assert sorted(os.listdir(tmp_path)) == ['b.entry.1.2.tmp']
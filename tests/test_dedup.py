@@ -0,0 +1,44 @@
+"""
+节点去重的测试
+    python -m pytest tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'subgen'))
+
+from config import BASE_CONFIG_TAG, Proxy  # noqa: E402
+from dedup import deduplicate_proxies  # noqa: E402
+
+
+def proxy(tag, name, server, port=443):
+    return Proxy(tag, name, {'name': name, 'type': 'ss', 'server': server, 'port': port})
+
+
+def names(proxies):
+    return [(proxy.tag, proxy.name) for proxy in proxies]
+
+
+def test_duplicates_removed_in_order():
+    proxies = [proxy('a', 'A', 'x'), proxy('b', 'B', 'x'), proxy('a', 'C', 'y')]
+    assert names(deduplicate_proxies(proxies)) == [('a', 'A'), ('a', 'C')]
+
+
+def test_prefer_tag_keeps_its_copy():
+    proxies = [proxy('a', 'A', 'x'), proxy('b', 'B', 'x'), proxy('a', 'C', 'y')]
+    assert names(deduplicate_proxies(proxies, ['b'])) == [('b', 'B'), ('a', 'C')]
+
+
+def test_same_name_renamed():
+    proxies = [proxy('a', 'HK', 'x'), proxy('b', 'HK', 'y'), proxy('b', 'HK 2', 'z'), proxy('c', 'HK', 'w')]
+    result = deduplicate_proxies(proxies)
+    assert names(result) == [('a', 'HK'), ('b', 'HK 3'), ('b', 'HK 2'), ('c', 'HK 4')]
+    assert [item.data['name'] for item in result] == ['HK', 'HK 3', 'HK 2', 'HK 4']
+
+
+def test_base_config_proxies_are_kept():
+    proxies = [proxy(BASE_CONFIG_TAG, 'Home', 'x'), proxy(BASE_CONFIG_TAG, 'Home copy', 'x'),
+               proxy('a', 'Home', 'y'), proxy('b', 'Sub', 'x')]
+    # 即使 prefer 中的 tag 排在前面, 基础配置中的节点也不会被删除或改名
+    result = deduplicate_proxies(proxies, ['b'])
+    assert names(result) == [(BASE_CONFIG_TAG, 'Home'), (BASE_CONFIG_TAG, 'Home copy'), ('a', 'Home 2')]
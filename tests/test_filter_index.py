@@ -0,0 +1,63 @@
+"""
+FilterIndex 的测试, 与逐个过滤器依次筛选节点列表的结果对比
+    python -m pytest tests
+"""
+import os
+import random
+import re
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'subgen'))
+
+from config import FilterIndex, Proxy, ProxyGroup  # noqa: E402
+
+REGIONS = ['HK', 'JP', 'SG', 'US', '香港', '日本']
+REGEXES = [None, '.*', 'HK|香港', 'JP', '^US', r'\d$', '1', 'x{2}', '']
+
+
+def reference_members(filters, proxies):
+    # 优化前的实现: 依次用每个过滤器筛选上一步的结果
+    if len(filters) == 0:
+        return []
+    result = list(proxies)
+    for filter_item in filters:
+        field = 'tag' if filter_item['type'] == 'tag' else 'name'
+        regex = filter_item['regex'] if filter_item['regex'] is not None else '.*'
+        negative_regex = filter_item['negative_regex'] if filter_item['negative_regex'] is not None \
+            else r'^(?!.*\S).*$'
+        result = [proxy for proxy in result
+                  if re.search(regex, getattr(proxy, field)) and not re.search(negative_regex, getattr(proxy, field))]
+    return result
+
+
+def random_proxies(rng, count):
+    return [Proxy(rng.choice(['A', 'B', 'US-sub', '']), f'{rng.choice(REGIONS)} {rng.randint(0, 20)}', {})
+            for _ in range(count)]
+
+
+def random_filters(rng):
+    return [{'type': rng.choice(['name', 'tag']), 'regex': rng.choice(REGEXES),
+             'negative_regex': rng.choice([None, *REGEXES[2:]])}
+            for _ in range(rng.randint(0, 3))]
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_members_match_sequential_filtering(seed):
+    rng = random.Random(seed)
+    proxies = random_proxies(rng, 200)
+    filter_lists = [random_filters(rng) for _ in range(8)]
+    groups = [ProxyGroup('select', f'group {index}', None, None, None, filters)
+              for index, filters in enumerate(filter_lists)]
+    # 多个分组共用一个索引, 相同的过滤器只编译一次
+    filter_index = FilterIndex(groups, proxies)
+    assert len(filter_index.filter_ids) <= sum(len(filters) for filters in filter_lists)
+    for group, filters in zip(groups, filter_lists):
+        assert filter_index.members(group.filters) == reference_members(filters, proxies)
+
+
+def test_group_without_filters_is_empty():
+    proxies = [Proxy('A', 'HK 1', {})]
+    group = ProxyGroup('select', 'empty', None, None, None, [])
+    assert group.generate(proxies)['proxies'] == []
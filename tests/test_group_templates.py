@@ -0,0 +1,47 @@
+"""
+分组模板的测试: 分组名称和名称冲突检查
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'subgen'))
+
+from config import GroupTemplate, Proxy, ProxyGroup  # noqa: E402
+from generator import generate_proxy_groups  # noqa: E402
+
+PROXIES = [Proxy('sub', name, {'name': name, 'type': 'ss'}) for name in ['HK 1', 'HK 2', 'JP 1', 'US 1', 'JP 2']]
+
+
+def template(name='{key}', parent=None, max_nodes=None):
+    return GroupTemplate(name, 'name', r'^(\w+) ', 'select', None, None, None, max_nodes, parent)
+
+
+def test_other_braces_are_kept():
+    groups = template('{region} {key} {}', max_nodes=1).generate(PROXIES)
+    assert [group['name'] for group in groups] == [
+        '{region} HK {} 1', '{region} HK {} 2', '{region} JP {} 1', '{region} JP {} 2', '{region} US {}']
+
+
+def test_parent_lists_shards():
+    parent, *groups = template('Auto {key}', parent='Regions').generate(PROXIES)
+    assert parent == {'name': 'Regions', 'type': 'select', 'proxies': ['Auto HK', 'Auto JP', 'Auto US']}
+    assert groups[1]['proxies'] == ['JP 1', 'JP 2']
+
+
+def test_template_name_collision_is_an_error():
+    proxy_groups = [ProxyGroup('select', 'JP', None, None, None, [], [])]
+    with pytest.raises(ValueError, match='Duplicate proxy group name: JP'):
+        generate_proxy_groups(proxy_groups, PROXIES, group_templates=[template()])
+    with pytest.raises(ValueError, match='conflicts with a proxy: HK 1'):
+        generate_proxy_groups([], PROXIES, group_templates=[template('{key} 1')])
+
+
+def test_hand_written_duplicates_only_warn(caplog):
+    proxy_groups = [ProxyGroup('select', 'A', None, None, None, [], []),
+                    ProxyGroup('select', 'A', None, None, None, [], [])]
+    groups = generate_proxy_groups(proxy_groups, PROXIES)
+    assert [group['name'] for group in groups] == ['A', 'A']
+    assert 'Duplicate proxy group name: A' in caplog.text
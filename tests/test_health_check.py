@@ -0,0 +1,66 @@
+"""
+节点可达性检查的测试, 使用本地监听的端口和已关闭的端口
+    python -m pytest tests
+"""
+import os
+import socket
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'subgen'))
+
+from config import BASE_CONFIG_TAG, Proxy  # noqa: E402
+from health_check import HealthChecker, apply_health_check  # noqa: E402
+
+
+@pytest.fixture
+def ports():
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen()
+    closed = socket.socket()
+    closed.bind(('127.0.0.1', 0))
+    closed_port = closed.getsockname()[1]
+    closed.close()
+    yield listener.getsockname()[1], closed_port
+    listener.close()
+
+
+def proxy(tag, name, port):
+    return Proxy(tag, name, {'name': name, 'type': 'ss', 'server': '127.0.0.1', 'port': port})
+
+
+def make_proxies(open_port, closed_port):
+    return [proxy('sub', 'down', closed_port), proxy('sub', 'up', open_port),
+            Proxy('sub', 'no server', {'name': 'no server', 'type': 'direct'}),
+            proxy(BASE_CONFIG_TAG, 'home', closed_port)]
+
+
+def test_check(ports):
+    open_port, closed_port = ports
+    checker = HealthChecker(timeout=1, cache_file=None)
+    reachable = checker.check(make_proxies(open_port, closed_port))
+    assert reachable == {f'127.0.0.1:{open_port}': True, f'127.0.0.1:{closed_port}': False}
+
+
+def test_drop_and_demote(ports):
+    open_port, closed_port = ports
+    proxies = make_proxies(open_port, closed_port)
+    reachable = HealthChecker(timeout=1, cache_file=None).check(proxies)
+    # 基础配置中的节点不可达时也保留
+    assert [item.name for item in apply_health_check(proxies, reachable, 'drop')] == ['up', 'no server', 'home']
+    assert [item.name for item in apply_health_check(proxies, reachable, 'demote')] == [
+        'up', 'no server', 'home', 'down']
+    with pytest.raises(ValueError):
+        apply_health_check(proxies, reachable, 'unknown')
+
+
+def test_results_cached_until_ttl(ports, tmp_path):
+    open_port, closed_port = ports
+    cache_file = str(tmp_path / 'health.json')
+    HealthChecker(timeout=1, cache_file=cache_file).check(make_proxies(open_port, closed_port))
+    # 从缓存文件读取结果, ttl 内不重新检查
+    checker = HealthChecker(timeout=1, ttl=600, cache_file=cache_file)
+    checker.probe_all = None
+    assert checker.check(make_proxies(open_port, closed_port))[f'127.0.0.1:{open_port}'] is True
@@ -0,0 +1,67 @@
+"""
+http_session 的测试, 使用本地 HTTP 服务作为源和镜像
+    python -m pytest tests
+"""
+import http.server
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'subgen'))
+
+import http_session  # noqa: E402
+
+
+class RecordingServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, status):
+        self.status = status
+        self.received = []
+        super().__init__(('127.0.0.1', 0), RecordingHandler)
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f'http://{host}:{port}/sub'
+
+
+class RecordingHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.received.append(self.headers.get('If-None-Match'))
+        body = b'content'
+        self.send_response(self.server.status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def servers():
+    started = [RecordingServer(500), RecordingServer(200)]
+    for server in started:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield started
+    for server in started:
+        server.shutdown()
+        server.server_close()
+
+
+def test_hedged_get_sends_conditional_headers_only_to_origin(servers):
+    primary, mirror = servers
+    headers = {'If-None-Match': '"v1"'}
+    response, url = http_session.hedged_get([primary.url, mirror.url], headers=headers, headers_url=primary.url)
+    assert (response.status_code, url) == (200, mirror.url)
+    assert primary.received == ['"v1"']
+    assert mirror.received == [None]
+
+
+def test_hedged_get_returns_last_failure(servers):
+    primary, _ = servers
+    response, url = http_session.hedged_get([primary.url, primary.url])
+    assert (response.status_code, url) == (500, primary.url)
@@ -0,0 +1,41 @@
+"""
+write_config 的测试: 逐行写入的规则与 yaml.dump 的结果一致
+    python -m pytest tests
+"""
+import io
+import os
+import sys
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'subgen'))
+
+from output import write_config  # noqa: E402
+
+RULES = [
+    'DOMAIN-SUFFIX,example.com,PROXY',
+    'IP-CIDR,10.0.0.0/8,DIRECT,no-resolve',
+    'DOMAIN,a.example.com,节点 选择',
+    "DOMAIN-KEYWORD,it's,PROXY",
+    'MATCH,: tricky #target',
+]
+
+
+def dump(config, rules):
+    file = io.StringIO()
+    write_config(file, config, rules)
+    return file.getvalue()
+
+
+def test_rules_round_trip():
+    config = {'port': 7890, 'proxies': [{'name': 'a', 'type': 'ss'}], 'rules': ['ignored']}
+    assert yaml.safe_load(dump(config, iter(RULES))) == {**config, 'rules': RULES}
+
+
+def test_empty_base_config():
+    assert yaml.safe_load(dump({}, iter(RULES))) == {'rules': RULES}
+    assert yaml.safe_load(dump({}, iter([]))) == {'rules': []}
+
+
+def test_no_rules():
+    assert yaml.safe_load(dump({'mode': 'rule'}, iter([]))) == {'mode': 'rule', 'rules': []}
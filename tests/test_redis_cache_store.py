@@ -0,0 +1,203 @@
+"""
+RedisCacheStore 的测试, 使用进程内的 RESP 替身服务, 只实现缓存用到的命令
+    python -m pytest tests
+"""
+import os
+import socketserver
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'subgen'))
+
+from redis_cache_store import RELEASE_SCRIPT, RedisCacheStore, RedisError  # noqa: E402
+
+
+class RespStandIn(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        self.data = {}
+        self.expiry = {}
+        self.lock = threading.Lock()
+        self.commands = []
+        super().__init__(('127.0.0.1', 0), RespHandler)
+
+    def alive(self, key):
+        if key in self.expiry and self.expiry[key] <= time.time():
+            self.data.pop(key, None)
+            self.expiry.pop(key, None)
+        return key in self.data
+
+    def run(self, command):
+        name = command[0].upper()
+        with self.lock:
+            self.commands.append(name)
+            if name in (b'AUTH', b'SELECT'):
+                return b'+OK\r\n'
+            if name == b'GET':
+                return bulk(self.data[command[1]] if self.alive(command[1]) else None)
+            if name == b'GETRANGE':
+                value = self.data[command[1]] if self.alive(command[1]) else b''
+                return bulk(value[int(command[2]):int(command[3]) + 1])
+            if name == b'SET':
+                return self.set(command[1], command[2], [option.upper() for option in command[3:]])
+            if name == b'EXPIRE':
+                if not self.alive(command[1]):
+                    return b':0\r\n'
+                self.expiry[command[1]] = time.time() + int(command[2])
+                return b':1\r\n'
+            if name == b'EVAL':
+                # 只支持释放租约的脚本: 值等于 token 时删除
+                if command[1].decode() != RELEASE_SCRIPT:
+                    return b'-ERR unknown script\r\n'
+                key, token = command[3], command[4]
+                if self.alive(key) and self.data[key] == token:
+                    del self.data[key]
+                    self.expiry.pop(key, None)
+                    return b':1\r\n'
+                return b':0\r\n'
+        return b'-ERR unknown command\r\n'
+
+    def set(self, key, value, options):
+        expire_at = None
+        for option, argument in zip(options, options[1:]):
+            if option in (b'EX', b'PX'):
+                amount = int(argument)
+                if amount <= 0:
+                    return b"-ERR invalid expire time in 'set' command\r\n"
+                expire_at = time.time() + (amount if option == b'EX' else amount / 1000)
+        if b'NX' in options and self.alive(key):
+            return b'$-1\r\n'
+        self.data[key] = value
+        self.expiry.pop(key, None)
+        if expire_at is not None:
+            self.expiry[key] = expire_at
+        return b'+OK\r\n'
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        command = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            command.append(self.rfile.read(length + 2)[:-2])
+        return command
+
+    def handle(self):
+        queued = None
+        while True:
+            command = self.read_command()
+            if command is None:
+                return
+            name = command[0].upper()
+            if name == b'MULTI':
+                self.server.commands.append(name)
+                queued = []
+                self.wfile.write(b'+OK\r\n')
+            elif name == b'EXEC':
+                replies = [self.server.run(queued_command) for queued_command in queued]
+                self.server.commands.append(name)
+                self.wfile.write(b'*%d\r\n' % len(replies) + b''.join(replies))
+                queued = None
+            elif queued is not None:
+                queued.append(command)
+                self.wfile.write(b'+QUEUED\r\n')
+            else:
+                self.wfile.write(self.server.run(command))
+
+
+def bulk(value):
+    return b'$-1\r\n' if value is None else b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+@pytest.fixture
+def server():
+    server = RespStandIn()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_store(server, **options):
+    host, port = server.server_address
+    return RedisCacheStore(f'redis://:secret@{host}:{port}/2', prefix='test:', **options)
+
+
+def test_write_and_read(server):
+    store = make_store(server)
+    assert store.age('a') is None
+    assert store.read_entry('a') == (None, None)
+    assert store.read_meta('a') == {}
+
+    store.write('a', '内容'.encode('utf-8'), {'etag': '"v1"'})
+    assert server.commands[-4:] == [b'MULTI', b'SET', b'SET', b'EXEC']
+    content, header = store.read_entry('a')
+    assert content == '内容'
+    assert header == {'etag': '"v1"', 'compression': None}
+    assert 0 <= store.age('a') < 5
+
+
+def test_read_meta_uses_getrange(server):
+    store = make_store(server)
+    store.configure(compression='gzip')
+    store.write('a', b'x' * 10000, {'last_modified': 'Mon, 01 Jan 2024 00:00:00 GMT'})
+    assert store.read_meta('a') == {'last_modified': 'Mon, 01 Jan 2024 00:00:00 GMT', 'compression': 'gzip'}
+    assert server.commands[-1] == b'GETRANGE'
+    assert store.read('a') == 'x' * 10000
+
+
+def test_exec_error_keeps_connection_in_sync(server):
+    store = make_store(server, ttl=0)
+    with pytest.raises(RedisError):
+        store.write('a', b'data', {})
+    # 出错的 EXEC 回复被完整读取, 之后的命令仍能得到自己的回复
+    store.ttl = None
+    store.write('a', b'data', {})
+    assert store.read('a') == 'data'
+
+
+def test_lease_is_exclusive(server):
+    first = make_store(server, lock_ttl=5, lock_wait=0.3)
+    second = make_store(server, lock_ttl=5, lock_wait=0.3)
+    with first.lock('a') as acquired:
+        assert acquired
+        start = time.monotonic()
+        with second.lock('a') as other_acquired:
+            assert not other_acquired
+        assert time.monotonic() - start >= 0.3
+    with second.lock('a') as acquired:
+        assert acquired
+
+
+def test_lease_released_only_by_holder(server):
+    first = make_store(server, lock_ttl=0.2, lock_wait=0).lock('a')
+    assert first.__enter__()
+    time.sleep(0.3)
+    # 租约已过期, 被其他主机重新获取
+    second = make_store(server, lock_ttl=5, lock_wait=0).lock('a')
+    assert second.__enter__()
+    lock_value = server.data[b'test:a:lock']
+
+    # 第一个持有者释放时 token 不匹配, 不会删除其他主机的租约
+    first.__exit__(None, None, None)
+    assert server.data[b'test:a:lock'] == lock_value
+    second.__exit__(None, None, None)
+    assert b'test:a:lock' not in server.data
+
+
+def test_reconnect_closes_broken_connection(server):
+    store = make_store(server)
+    store.write('a', b'data', {})
+    broken = store.connection()
+    broken.sock.shutdown(2)
+    assert store.read('a') == 'data'
+    assert store.connection() is not broken
+    assert broken.sock.fileno() == -1
@@ -0,0 +1,122 @@
+"""
+外部资源的缓存测试: ETag 重新验证、stale 窗口内的后台刷新
+    python -m pytest tests
+"""
+import http.server
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'subgen'))
+
+import utils  # noqa: E402
+from cache_store import CacheStore  # noqa: E402
+from utils import ExternalResource  # noqa: E402
+
+
+class ResourceServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        self.content = b'v1'
+        self.etag = '"v1"'
+        self.requests = []
+        super().__init__(('127.0.0.1', 0), ResourceHandler)
+
+    def update(self, version):
+        self.content = version.encode()
+        self.etag = f'"{version}"'
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f'http://{host}:{port}/sub.txt'
+
+
+class ResourceHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if_none_match = self.headers.get('If-None-Match')
+        self.server.requests.append(if_none_match)
+        if if_none_match == self.server.etag:
+            self.send_response(304)
+            self.send_header('ETag', self.server.etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', self.server.etag)
+        self.send_header('Content-Length', str(len(self.server.content)))
+        self.end_headers()
+        self.wfile.write(self.server.content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ResourceServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = CacheStore(str(tmp_path))
+    monkeypatch.setattr(utils, 'cache_store', store)
+    return store
+
+
+def set_age(store, resource, age):
+    fetched_time = time.time() - age
+    os.utime(store.entry_file(resource.cache_key()), (fetched_time, fetched_time))
+
+
+def test_etag_revalidation(server, store):
+    resource = ExternalResource('http', server.url, 60)
+    assert resource.load() == 'v1'
+    assert server.requests == [None]
+    assert store.read_meta(resource.cache_key())['etag'] == '"v1"'
+
+    # 缓存未过期时不发出请求
+    assert resource.load() == 'v1'
+    assert server.requests == [None]
+
+    # 过期后带上 ETag 重新验证, 304 时使用缓存并更新下载时间
+    set_age(store, resource, 100)
+    content, entry = resource.load_entry()
+    assert (content, entry['etag']) == ('v1', '"v1"')
+    assert server.requests == [None, '"v1"']
+    assert store.age(resource.cache_key()) < 5
+
+    # 内容变化时返回新内容和新的 ETag
+    server.update('v2')
+    set_age(store, resource, 100)
+    assert resource.load() == 'v2'
+    assert server.requests == [None, '"v1"', '"v1"']
+    assert store.read_meta(resource.cache_key())['etag'] == '"v2"'
+
+
+def test_stale_window(server, store):
+    resource = ExternalResource('http', server.url, 10, stale_time=1000)
+    assert resource.load() == 'v1'
+
+    # 在 stale 窗口内先返回旧内容, 后台重新验证后缓存更新
+    server.update('v2')
+    set_age(store, resource, 100)
+    assert resource.load() == 'v1'
+    deadline = time.monotonic() + 5
+    while store.read(resource.cache_key()) != 'v2' and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert store.read(resource.cache_key()) == 'v2'
+    assert server.requests == [None, '"v1"']
+    assert resource.load() == 'v2'
+
+    # 超出 stale 窗口时同步下载
+    server.update('v3')
+    set_age(store, resource, 2000)
+    assert resource.load() == 'v3'
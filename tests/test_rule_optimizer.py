@@ -0,0 +1,49 @@
+"""
+规则优化的测试: 优化前后的规则对随机查询的第一条匹配结果相同
+    python -m pytest tests
+"""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'subgen'))
+
+from config import Rule  # noqa: E402
+from rule_optimizer import compact_rules  # noqa: E402
+from test_simulator import linear_match, random_query, random_rules  # noqa: E402
+
+
+def first_target(rules, query):
+    index, determined = linear_match(rules, query)
+    if index is None:
+        return None
+    return rules[index].target, determined
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_same_first_match(seed):
+    rng = random.Random(seed)
+    rules = random_rules(rng, rng.randint(1, 300), barriers=seed % 3 == 0)
+    compacted, removed = compact_rules(rules)
+    assert removed == len(rules) - len(compacted)
+    for _ in range(300):
+        query = random_query(rng)
+        assert first_target(compacted, query) == first_target(rules, query), query
+
+
+def test_shadowed_rules_removed_and_networks_merged():
+    rules = [
+        Rule('DOMAIN-SUFFIX', 'google.com', 'PROXY'),
+        Rule('DOMAIN', 'www.google.com', 'DIRECT'),
+        Rule('IP-CIDR', '10.0.0.0/25', 'DIRECT'),
+        Rule('IP-CIDR', '10.0.0.128/25', 'DIRECT'),
+        Rule('IP-CIDR', '10.0.0.5/32', 'PROXY'),
+        Rule('MATCH', None, 'PROXY'),
+        Rule('DOMAIN', 'after.match', 'DIRECT'),
+    ]
+    compacted, removed = compact_rules(rules)
+    assert [rule.to_string() for rule in compacted] == [
+        'DOMAIN-SUFFIX,google.com,PROXY', 'IP-CIDR,10.0.0.0/24,DIRECT', 'MATCH,PROXY']
+    assert removed == 4
@@ -0,0 +1,82 @@
+"""
+规则集解析的测试, 结果与 yaml.safe_load 对比
+    python -m pytest tests
+"""
+import os
+import random
+import sys
+
+import pytest
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'subgen'))
+
+import ruleset_parser  # noqa: E402
+from metrics import metrics  # noqa: E402
+
+VALUES = [
+    'example.com', '+.example.com', '.example.com', 'DOMAIN-SUFFIX,example.com', 'IP-CIDR,1.2.3.0/24,no-resolve',
+    '1.2.3.0/24', '2001:db8::/32', '香港.example', "it's", 'a # b', 'a#b', 'null', 'yes', '12', '1:20', '0x1F',
+    '~', 'key: value', 'ends:', '*.example.com', '?', '- nested', '"quoted"', 'tab\there', 'x' * 200
+]
+
+
+def payload_item(rng, value):
+    style = rng.choice(['plain', 'single', 'double'])
+    if style == 'single':
+        item = "'" + value.replace("'", "''") + "'"
+    elif style == 'double':
+        item = '"' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\t', '\\t') + '"'
+    else:
+        item = value
+    comment = rng.choice(['', '', '  # 注释'])
+    return f'{rng.choice(["  ", ""])}- {item}{comment}'
+
+
+def payload_content(rng):
+    lines = [rng.choice(['payload:', 'payload: # 规则']), '# 注释', '']
+    lines += [payload_item(rng, rng.choice(VALUES)) for _ in range(rng.randint(0, 30))]
+    return '\n'.join(lines) + rng.choice(['', '\n'])
+
+
+def safe_load_payload(content):
+    try:
+        data = yaml.safe_load(content)
+    except yaml.YAMLError:
+        return None
+    return data['payload'] if data['payload'] is not None else []
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_payload_matches_safe_load(seed):
+    content = payload_content(random.Random(seed))
+    expected = safe_load_payload(content)
+    if expected is None:
+        # YAML 本身无法解析的内容, 逐行解析也不能接受
+        with pytest.raises(Exception):
+            ruleset_parser.parse(content, 'test')
+        return
+    assert ruleset_parser.parse(content, 'test') == expected
+
+
+def yaml_layout_count():
+    return metrics.values.get('rulesets_parsed_total', {}).get((('layout', 'yaml'),), 0)
+
+
+@pytest.mark.parametrize('content', [
+    'payload: [a.com, b.com]\n',
+    'payload:\n  - a.com\n  - b.com\nother: 1\n',
+    '---\npayload:\n  - a.com\n',
+    'payload:\n  - >-\n    folded\n    value\n',
+    'payload:\n  - &anchor a.com\n  - *anchor\n'
+])
+def test_complex_layouts_fall_back_to_yaml(content):
+    before = yaml_layout_count()
+    assert ruleset_parser.parse(content, 'test') == yaml.safe_load(content)['payload']
+    assert yaml_layout_count() == before + 1
+
+
+def test_text_layout():
+    content = '# 注释\nexample.com\n\n  +.example.org  \n1.2.3.0/24\n'
+    assert ruleset_parser.parse(content, 'test') == ['example.com', '+.example.org', '1.2.3.0/24']
+    assert ruleset_parser.parse('', 'test') == []
@@ -0,0 +1,72 @@
+"""
+常驻生成服务的测试, 配置中没有外部资源, 不访问网络
+    python -m pytest tests
+"""
+import json
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'subgen'))
+
+import utils  # noqa: E402
+from cache_store import CacheStore  # noqa: E402
+from config import Config  # noqa: E402
+from server import GenerationServer, REGENERATE_INTERVAL  # noqa: E402
+from utils import ExternalResource  # noqa: E402
+
+BASE_CONFIG = {'proxies': [{'name': 'local', 'type': 'socks5', 'server': '127.0.0.1', 'port': 1080}]}
+
+
+@pytest.fixture
+def generation_config(tmp_path):
+    path = tmp_path / 'config.json'
+    path.write_text(json.dumps({
+        'subscriptions': [],
+        'proxy_groups': [{'type': 'select', 'name': 'PROXY', 'filters': [{'type': 'name', 'regex': '.*'}]}],
+        'rulesets': [
+            {'type': 'DOMAIN-SUFFIX', 'params': ['lan'], 'target': 'DIRECT'},
+            {'type': 'match', 'target': 'PROXY'}
+        ]
+    }), encoding='utf-8')
+    return Config(str(path), configure=False)
+
+
+def test_output_written_to_configured_path(generation_config, tmp_path):
+    output = tmp_path / 'out' / 'config.yaml'
+    output.parent.mkdir()
+    server = GenerationServer(generation_config, BASE_CONFIG, str(output))
+    body, etag = server.latest()
+    assert server.output_dir == str(output.parent)
+    assert output.read_bytes() == body
+    assert b'local' in body
+
+
+def test_regenerates_on_schedule_without_changes(generation_config):
+    server = GenerationServer(generation_config, BASE_CONFIG)
+    assert server.regenerate_interval == REGENERATE_INTERVAL
+    regenerated = []
+    server.regenerate = lambda: regenerated.append(1)
+    server.refresh()
+    assert regenerated == []
+    server.next_regenerate = time.time() - 1
+    server.refresh()
+    assert regenerated == [1]
+
+
+def test_first_refresh_scheduled_from_cache_age(tmp_path, monkeypatch):
+    store = CacheStore(str(tmp_path))
+    monkeypatch.setattr(utils, 'cache_store', store)
+    resource = ExternalResource('http', 'http://127.0.0.1/sub.txt', 100)
+    assert resource.remaining_cache_time() == 100
+
+    key = resource.cache_key()
+    store.write(key, b'content', {})
+    fetched_time = time.time() - 30
+    os.utime(store.entry_file(key), (fetched_time, fetched_time))
+    assert 69 <= resource.remaining_cache_time() <= 70
+
+    os.utime(store.entry_file(key), (0, 0))
+    assert resource.remaining_cache_time() == 0
@@ -0,0 +1,115 @@
+"""
+规则匹配模拟的测试, 与按顺序逐条匹配的结果比较
+    python -m pytest tests
+"""
+import ipaddress
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'subgen'))
+
+from config import Rule  # noqa: E402
+from simulator import RangeTable, RuleSimulator  # noqa: E402
+
+LABELS = ['a', 'b', 'cd', 'google', 'com', 'net', 'cn', 'x']
+
+
+def random_domain(rng):
+    return '.'.join(rng.choice(LABELS) for _ in range(rng.randint(1, 4)))
+
+
+def random_network(rng):
+    if rng.random() < 0.8:
+        prefix = rng.randint(4, 32)
+        address = rng.getrandbits(32) & (0xffffffff << (32 - prefix))
+        return f'{ipaddress.IPv4Address(address)}/{prefix}'
+    return f'2001:{rng.randint(0, 3):x}::/{rng.randint(16, 48)}'
+
+
+def random_rules(rng, count, barriers):
+    rules = []
+    for index in range(count):
+        kind = rng.random()
+        target = f'T{index % 4}'
+        if kind < 0.3:
+            rules.append(Rule('DOMAIN-SUFFIX', random_domain(rng), target))
+        elif kind < 0.5:
+            rules.append(Rule('DOMAIN', random_domain(rng), target))
+        elif kind < 0.6:
+            rules.append(Rule('DOMAIN-KEYWORD', rng.choice(LABELS) + rng.choice(['', 'o', '.']), target))
+        elif kind < 0.95 or not barriers:
+            network = random_network(rng)
+            rules.append(Rule('IP-CIDR6' if ':' in network else 'IP-CIDR', network, target))
+        else:
+            rules.append(Rule(rng.choice(['GEOIP', 'RULE-SET', 'SRC-IP-CIDR', 'PROCESS-NAME']), 'x', target))
+    if rng.random() < 0.5:
+        rules.insert(rng.randint(0, len(rules)), Rule('MATCH', None, 'FINAL'))
+    return rules
+
+
+def random_query(rng):
+    kind = rng.random()
+    if kind < 0.5:
+        return random_domain(rng).upper() if rng.random() < 0.1 else random_domain(rng)
+    if kind < 0.9:
+        return str(ipaddress.IPv4Address(rng.getrandbits(32)))
+    return f'2001:{rng.randint(0, 3):x}::{rng.randint(0, 0xffff):x}'
+
+
+def linear_match(rules, query):
+    """按顺序逐条匹配, 返回 (规则序号, 是否确定)"""
+    try:
+        address = ipaddress.ip_address(query)
+    except ValueError:
+        address = None
+    domain = query.lower()
+    for index, rule in enumerate(rules):
+        rule_type, param = rule.rule_type, rule.param
+        if rule_type == 'MATCH':
+            return index, True
+        if rule_type in ('IP-CIDR', 'IP-CIDR6'):
+            network = ipaddress.ip_network(param, strict=False)
+            if address is not None and address.version == network.version and address in network:
+                return index, True
+        elif rule_type in ('DOMAIN', 'DOMAIN-SUFFIX', 'DOMAIN-KEYWORD'):
+            if address is not None:
+                continue
+            if rule_type == 'DOMAIN' and domain == param:
+                return index, True
+            if rule_type == 'DOMAIN-SUFFIX' and (domain == param or domain.endswith('.' + param)):
+                return index, True
+            if rule_type == 'DOMAIN-KEYWORD' and param in domain:
+                return index, True
+        else:
+            return index, False
+    return None, True
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_matches_linear_scan(seed):
+    rng = random.Random(seed)
+    rules = random_rules(rng, rng.randint(1, 300), barriers=seed % 2 == 1)
+    simulator = RuleSimulator(rules)
+    for _ in range(300):
+        query = random_query(rng)
+        assert simulator.match(query) == linear_match(rules, query), query
+
+
+def test_barrier_is_undetermined():
+    rules = [Rule('DOMAIN-SUFFIX', 'google.com', 'PROXY'), Rule('GEOIP', 'CN', 'DIRECT'),
+             Rule('DOMAIN', 'baidu.com', 'DIRECT'), Rule('MATCH', None, 'PROXY')]
+    simulator = RuleSimulator(rules)
+    results = list(simulator.simulate(['www.google.com', 'baidu.com', '1.2.3.4']))
+    assert [(rule.target, determined) for _, rule, determined in results] == [
+        ('PROXY', True), ('DIRECT', False), ('DIRECT', False)]
+    assert results[1][1] is rules[1]
+    assert simulator.undetermined == 2
+    assert simulator.rule_hits() == [(rules[0], 1)]
+
+
+def test_range_table_keeps_lowest_index():
+    table = RangeTable([(10, 20, 3), (15, 30, 1), (40, 50, 2)])
+    assert [table.lookup(value) for value in (9, 10, 15, 25, 31, 45, 51)] == [None, 3, 1, 1, None, 2, None]
@@ -0,0 +1,92 @@
+"""
+快照文件的测试: 写入后读取、损坏文件的检查、导出本次加载的内容
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'subgen'))
+
+import utils  # noqa: E402
+from snapshot import FOOTER, MAGIC, Snapshot, write_snapshot  # noqa: E402
+from utils import ExternalResource, calculate_content_hash, load_resources  # noqa: E402
+
+ENTRIES = [
+    {'url': 'http://a/sub.txt', 'resource_type': 'http', 'fetched_at': 1000.5, 'etag': '"v1"',
+     'last_modified': None, 'content': '节点\n' * 100},
+    {'url': 'rules.yaml', 'resource_type': 'file', 'fetched_at': 2000.0, 'etag': None,
+     'last_modified': 'Mon, 01 Jan 2024 00:00:00 GMT', 'content': ''}
+]
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    path = str(tmp_path / 'snap.bin')
+    write_snapshot(path, ENTRIES)
+    return path
+
+
+def test_round_trip(snapshot_path):
+    snapshot = Snapshot(snapshot_path)
+    for entry in ENTRIES:
+        assert snapshot.read(entry['url']) == entry['content']
+        index_entry = snapshot.entry(entry['url'])
+        for field in ('resource_type', 'fetched_at', 'etag', 'last_modified'):
+            assert index_entry[field] == entry[field]
+    with pytest.raises(ValueError, match='not in snapshot'):
+        snapshot.entry('http://missing')
+    snapshot.close()
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / 'empty.bin'
+    path.write_bytes(b'')
+    with pytest.raises(ValueError, match='empty or truncated'):
+        Snapshot(str(path))
+
+
+@pytest.mark.parametrize('length', [len(MAGIC) + FOOTER.size, 100, -1])
+def test_truncated_file(snapshot_path, length):
+    with open(snapshot_path, 'rb') as file:
+        data = file.read()
+    with open(snapshot_path, 'wb') as file:
+        file.write(data[:length])
+    with pytest.raises(ValueError, match='Invalid snapshot file'):
+        Snapshot(snapshot_path)
+
+
+def test_index_out_of_bounds(snapshot_path):
+    with open(snapshot_path, 'rb') as file:
+        data = file.read()
+    index_offset, index_length, magic = FOOTER.unpack(data[-FOOTER.size:])
+    with open(snapshot_path, 'wb') as file:
+        file.write(data[:-FOOTER.size] + FOOTER.pack(index_offset, index_length + 10, magic))
+    with pytest.raises(ValueError, match='index out of bounds'):
+        Snapshot(snapshot_path)
+
+
+def test_export_uses_loaded_content(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, 'keep_loaded', True)
+    path = tmp_path / 'rules.txt'
+    path.write_text('v1', encoding='utf-8')
+    resource = ExternalResource('file', str(path), None)
+    [content] = load_resources([resource])
+    resource.content_hash = calculate_content_hash(content)
+
+    # 加载后文件被修改, 导出的仍是本次加载的内容
+    path.write_text('v2', encoding='utf-8')
+    entry = resource.snapshot_entry()
+    assert entry['content'] == 'v1'
+    assert entry['fetched_at'] is not None
+
+    resource.content_hash = calculate_content_hash('v2')
+    with pytest.raises(ValueError, match='does not match'):
+        resource.snapshot_entry()
+
+
+def test_export_requires_kept_content(tmp_path):
+    resource = ExternalResource('file', str(tmp_path / 'rules.txt'), None)
+    with pytest.raises(ValueError, match='not kept'):
+        resource.snapshot_entry()
@@ -0,0 +1,100 @@
+"""
+订阅解析的测试: base64 分块解码、多进程分批解析
+    python -m pytest tests
+"""
+import base64
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'subgen'))
+
+import sub_parser  # noqa: E402
+from utils import iter_base64_lines  # noqa: E402
+
+
+def subscription_lines(count):
+    lines = [f'trojan://pw{index}@hk{index}.example.com:443?sni=x.com#香港%20{index}' for index in range(count)]
+    # 不支持的类型和空行
+    lines[3] = 'unknown://node'
+    lines[5] = ''
+    return lines
+
+
+def encode(lines, line_width=None):
+    encoded = base64.b64encode('\n'.join(lines).encode('utf-8')).decode()
+    if line_width is not None:
+        # 部分订阅每隔固定长度换行
+        encoded = '\r\n'.join(encoded[start:start + line_width] for start in range(0, len(encoded), line_width))
+    return encoded
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 4, 7, 64, 1 << 16])
+@pytest.mark.parametrize('line_width', [None, 76])
+def test_iter_base64_lines_matches_b64decode(chunk_size, line_width):
+    lines = subscription_lines(50)
+    encoded = encode(lines, line_width)
+    expected = base64.b64decode(encoded.replace('\r\n', '')).decode('utf-8').split('\n')
+    assert list(iter_base64_lines(encoded, chunk_size)) == expected == lines
+
+
+def test_iter_base64_lines_unpadded():
+    encoded = base64.b64encode('a\nbc'.encode()).decode().rstrip('=')
+    assert list(iter_base64_lines(encoded, 3)) == ['a', 'bc']
+
+
+@pytest.fixture
+def parse_settings():
+    yield
+    sub_parser.configure(1, 5000)
+    sub_parser.shutdown_pool()
+
+
+def test_parallel_parse_matches_serial(parse_settings):
+    encoded = encode(subscription_lines(200))
+    sub_parser.configure(1)
+    serial_nodes, serial_stats = sub_parser.parse_with_stats(encoded, 'serial')
+
+    sub_parser.configure(2, 7)
+    parallel_nodes, parallel_stats = sub_parser.parse_with_stats(encoded, 'parallel')
+    assert parallel_nodes == serial_nodes
+    assert parallel_stats == serial_stats
+    assert serial_stats[('trojan', 'accepted')] == 198
+    assert serial_stats[('unknown', 'unsupported')] == 1
+
+
+def test_pool_rebuilt_when_workers_change(parse_settings):
+    sub_parser.configure(2)
+    pool = sub_parser.get_pool()
+    sub_parser.configure(2)
+    assert sub_parser.get_pool() is pool
+    sub_parser.configure(3)
+    new_pool = sub_parser.get_pool()
+    assert new_pool is not pool
+    assert new_pool._max_workers == 3
+
+
+def test_map_batches_bounds_in_flight_batches(parse_settings):
+    read = []
+
+    def batches():
+        for index in range(10):
+            read.append(index)
+            yield [f'unknown://{index}']
+
+    class RecordingPool:
+        def __init__(self):
+            self.pool = sub_parser.get_pool()
+
+        def submit(self, fn, batch):
+            # 提交时已读取的批次不超过已返回的批次数加上窗口大小
+            assert len(read) <= returned + 3
+            return self.pool.submit(fn, batch)
+
+    sub_parser.configure(2)
+    returned = 0
+    for _, stats, _ in sub_parser.map_batches(RecordingPool(), batches(), 3):
+        assert stats == {('unknown', 'unsupported'): 1}
+        returned += 1
+    assert returned == 10